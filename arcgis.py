@@ -0,0 +1,212 @@
+# coding: utf-8
+import os
+import os.path
+import re
+import shutil
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from zipfile import ZIP_DEFLATED, ZipFile, ZipInfo
+
+from cache import digest
+from downloads import Download, chunk_size
+from esri import Field, PolygonWriter, WGS84_PRJ
+from remote import timeout
+
+"""
+The URL of an ArcGIS REST API map or feature service layer.
+"""
+layer_url_re = re.compile(r'/rest/services/.+/(?:MapServer|FeatureServer)/\d+/?\Z', re.IGNORECASE)
+
+"""
+The .dbf fields for ArcGIS field types. Other types, like geometry and blob
+fields, are skipped.
+
+@see https://developers.arcgis.com/documentation/common-data-types/field.htm
+"""
+field_types = {
+    'esriFieldTypeOID': ('N', 10, 0),
+    'esriFieldTypeSmallInteger': ('N', 5, 0),
+    'esriFieldTypeInteger': ('N', 10, 0),
+    'esriFieldTypeSingle': ('N', 24, 15),
+    'esriFieldTypeDouble': ('N', 24, 15),
+    'esriFieldTypeString': ('C', None, 0),
+    'esriFieldTypeDate': ('D', 8, 0),
+    'esriFieldTypeGUID': ('C', 38, 0),
+    'esriFieldTypeGlobalID': ('C', 38, 0),
+}
+
+"""
+The number of features to request per page, if the layer doesn't set a maximum.
+"""
+page_size = 1000
+
+"""
+The timestamp of files written from a layer that doesn't track edits, which is
+the earliest ZIP timestamp.
+"""
+epoch = datetime(1980, 1, 1)
+
+
+class ArcGISError(Exception):
+    """
+    Raised if an ArcGIS REST API request returns an error.
+    """
+
+
+def is_layer_url(url):
+    return bool(layer_url_re.search(url.split('?', 1)[0]))
+
+
+def get_json(session, url, params, **arguments):
+    """
+    Returns the JSON response to an ArcGIS REST API request. Raises `ArcGISError`
+    if the response is an error, which the API returns with a 200 status code.
+    """
+    params = dict(params, f='json')
+    response = session.get(url, params=params, timeout=timeout, **arguments)
+    response.raise_for_status()
+    try:
+        data = response.json()
+    except ValueError:
+        raise ArcGISError('Invalid JSON response %s' % response.url)
+    if 'error' in data:
+        error = data['error']
+        raise ArcGISError('%s %s' % (error.get('code'), error.get('message')))
+    return data
+
+
+def layer_info(session, url, **arguments):
+    """
+    Returns the description of a layer.
+    """
+    return get_json(session, url.rstrip('/'), {}, **arguments)
+
+
+def last_edit_date(info):
+    """
+    Returns the date and time at which a layer was last edited, in milliseconds
+    since the epoch, or None if the layer doesn't track edits.
+    """
+    return (info.get('editingInfo') or {}).get('lastEditDate')
+
+
+def to_datetime(milliseconds):
+    return datetime.utcfromtimestamp(milliseconds / 1000)
+
+
+def layer_fields(info):
+    """
+    Returns the .dbf fields for a layer's fields.
+    """
+    fields = []
+    for field in info.get('fields') or []:
+        if field['type'] in field_types:
+            field_type, length, decimals = field_types[field['type']]
+            if length is None:
+                length = max(min(field.get('length') or 254, 254), 1)
+            fields.append(Field(field['name'], field_type, length, decimals))
+    return fields
+
+
+def pages(session, url, info, **arguments):
+    """
+    Returns the query parameters of each page of a layer's features: ranges of
+    object IDs, if the layer supports returning IDs, or offsets otherwise.
+    Raises `ArcGISError` if the layer supports neither and has more than one
+    page of features, as a server ignores offsets it doesn't support.
+    """
+    size = info.get('maxRecordCount') or page_size
+    query_url = '%s/query' % url.rstrip('/')
+    params = {'where': '1=1', 'returnIdsOnly': 'true'}
+    data = get_json(session, query_url, params, **arguments)
+    if data.get('objectIds') is not None:
+        name = data['objectIdFieldName']
+        ids = sorted(data['objectIds'])
+        return [{'where': '%s >= %d AND %s <= %d' % (name, ids[i], name, ids[min(i + size, len(ids)) - 1])} for i in range(0, len(ids), size)]
+
+    count = get_json(session, query_url, {'where': '1=1', 'returnCountOnly': 'true'}, **arguments)['count']
+    if count > size and not (info.get('advancedQueryCapabilities') or {}).get('supportsPagination'):
+        raise ArcGISError('Neither object IDs nor pagination are supported for %d features' % count)
+    results = []
+    for offset in range(0, count, size):
+        params = {'where': '1=1', 'resultOffset': offset, 'resultRecordCount': size}
+        # Pages are stable only if ordered.
+        for field in info.get('fields') or []:
+            if field['type'] == 'esriFieldTypeOID':
+                params['orderByFields'] = field['name']
+        results.append(params)
+    return results
+
+
+def bounded_map(function, items, jobs):
+    """
+    Yields the results of a function on each item, in order, running at most
+    `jobs` calls at a time, and holding at most `jobs` results in memory.
+    """
+    with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+        futures = deque()
+        for item in items:
+            if len(futures) >= max(jobs, 1):
+                yield futures.popleft().result()
+            futures.append(executor.submit(function, item))
+        while futures:
+            yield futures.popleft().result()
+
+
+def fetch_layer(session, url, path, info, encoding='utf-8', jobs=2, **arguments):
+    """
+    Writes a layer's features to a polygon shapefile in longitude and latitude,
+    requesting `jobs` pages at a time, and returns the number of features.
+    `path` is the path to the shapefile without its extension.
+    """
+    query_url = '%s/query' % url.rstrip('/')
+    fields = layer_fields(info)
+    edited = last_edit_date(info)
+    modified = to_datetime(edited) if edited else epoch
+
+    def fetch(params):
+        params = dict(params, outFields='*', returnGeometry='true', outSR=4326)
+        return get_json(session, query_url, params, **arguments)['features']
+
+    count = 0
+    with PolygonWriter(path, encoding=encoding, prj=WGS84_PRJ, fields=fields, modified=modified.date()) as writer:
+        for features in bounded_map(fetch, pages(session, url, info, **arguments), jobs):
+            for feature in features:
+                # ArcGIS rings are ordered like shapefile rings: outer rings clockwise, inner rings counter-clockwise.
+                rings = [[(point[0], point[1]) for point in ring] for ring in (feature.get('geometry') or {}).get('rings') or []]
+                attributes = feature.get('attributes') or {}
+                for field in fields:
+                    if field.type == 'D' and attributes.get(field.name) is not None:
+                        attributes[field.name] = to_datetime(attributes[field.name]).date()
+                writer.write(rings, attributes)
+                count += 1
+    return count
+
+
+def download_layer(session, url, path, basename, info, encoding='utf-8', jobs=2, **arguments):
+    """
+    Downloads a layer as a zipped shapefile named `basename` to `path`, and
+    returns a `Download` and the number of features. Timestamps are set to the
+    layer's last edit date, so that an unchanged layer produces an identical
+    file.
+    """
+    started = time.time()
+    directory = tempfile.mkdtemp(dir=os.path.dirname(path))
+    try:
+        count = fetch_layer(session, url, os.path.join(directory, basename), info, encoding=encoding, jobs=jobs, **arguments)
+        edited = last_edit_date(info)
+        date_time = (to_datetime(edited) if edited else epoch).timetuple()[:6]
+        with ZipFile(path, 'w') as zip_file:
+            for name in sorted(os.listdir(directory)):
+                member = ZipInfo(name, date_time=date_time)
+                member.compress_type = ZIP_DEFLATED
+                with open(os.path.join(directory, name), 'rb') as f, zip_file.open(member, 'w') as out:
+                    shutil.copyfileobj(f, out, chunk_size)
+    finally:
+        shutil.rmtree(directory)
+
+    download = Download(path, os.path.getsize(path), digest(path, 'sha256'), time.time() - started)
+    return download, count
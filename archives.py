@@ -0,0 +1,160 @@
+# coding: utf-8
+import os
+import os.path
+import struct
+import tempfile
+import zlib
+from zipfile import ZIP_DEFLATED, ZIP_STORED, BadZipfile, ZipFile
+
+"""
+The number of bytes to read from an archive at a time.
+"""
+chunk_size = 1 << 20
+
+"""
+The size in bytes above which a nested archive is spooled to disk.
+"""
+spool_size = 1 << 23
+
+"""
+A ZIP local file header: signature, versions, flags, compression method, time,
+date, CRC-32, sizes, and the lengths of the filename and extra field.
+"""
+LOCAL_HEADER = struct.Struct('<4s2B4HL2L2H')
+LOCAL_HEADER_SIGNATURE = b'PK\x03\x04'
+
+
+def target(name, config):
+    """
+    Returns the basename to which to extract a ZIP member, or None if the member
+    isn't extracted.
+    """
+    # Don't extract directories.
+    if name[-1] == '/':
+        return None
+    # Flatten the zip file hierarchy.
+    extension = os.path.splitext(name)[1]
+    if extension in ('.kml', '.kmz'):
+        basename = 'data%s' % extension  # assumes one KML or KMZ file per archive
+    else:
+        basename = os.path.basename(name)  # assumes no collisions across hierarchy
+    # Extract only matching shapefiles.
+    if 'basename' in config and basename.split(os.extsep, 1)[0] != config['basename']:
+        return None
+    return basename
+
+
+def read_exactly(fileobj, size):
+    data = fileobj.read(size)
+    if len(data) != size:
+        raise BadZipfile('Truncated file')
+    return data
+
+
+def read_member(zip_file, fileobj, info, skip_crc32=False):
+    """
+    Yields the uncompressed contents of a ZIP member, at most `chunk_size` bytes
+    at a time. `fileobj` is the ZIP file's file object. Unless `skip_crc32`,
+    raises `BadZipfile` if the CRC-32 doesn't match.
+    """
+    if info.compress_type not in (ZIP_STORED, ZIP_DEFLATED) or info.flag_bits & 0x1:
+        # Other compression methods and encryption are left to the zipfile module.
+        with zip_file.open(info) as fp:
+            for chunk in iter(lambda: fp.read(chunk_size), b''):
+                yield chunk
+        return
+
+    fileobj.seek(info.header_offset)
+    header = LOCAL_HEADER.unpack(read_exactly(fileobj, LOCAL_HEADER.size))
+    if header[0] != LOCAL_HEADER_SIGNATURE:
+        raise BadZipfile('Bad local file header for %s' % info.filename)
+    fileobj.seek(header[-2] + header[-1], os.SEEK_CUR)
+
+    if info.compress_type == ZIP_DEFLATED:
+        decompressor = zlib.decompressobj(-15)
+    else:
+        decompressor = None
+
+    crc = 0
+    size = 0
+    remaining = info.compress_size
+    while remaining:
+        data = read_exactly(fileobj, min(chunk_size, remaining))
+        remaining -= len(data)
+        if decompressor:
+            # Limit the size of each decompressed chunk.
+            while data:
+                chunk = decompressor.decompress(data, chunk_size)
+                data = decompressor.unconsumed_tail
+                crc = zlib.crc32(chunk, crc)
+                size += len(chunk)
+                yield chunk
+        else:
+            crc = zlib.crc32(data, crc)
+            size += len(data)
+            yield data
+    if decompressor:
+        chunk = decompressor.flush()
+        crc = zlib.crc32(chunk, crc)
+        size += len(chunk)
+        yield chunk
+
+    if size != info.file_size:
+        raise BadZipfile('Bad size for file %r' % info.filename)
+    if not skip_crc32 and crc != info.CRC:
+        raise BadZipfile('Bad CRC-32 for file %r' % info.filename)
+
+
+def extract_kml(fileobj, directory, skip_crc32=False):
+    """
+    Extracts the KML file from a KMZ file to data.kml, and returns the number of
+    bytes extracted.
+    """
+    size = 0
+    zip_file = ZipFile(fileobj)
+    for info in zip_file.infolist():
+        # A KMZ file contains a single KML file and other supporting files.
+        # @see https://developers.google.com/kml/documentation/kmzarchives
+        if os.path.splitext(info.filename)[1] == '.kml':
+            with open(os.path.join(directory, 'data.kml'), 'wb') as f:
+                for chunk in read_member(zip_file, fileobj, info, skip_crc32):
+                    f.write(chunk)
+                    size += len(chunk)
+    return size
+
+
+def extract(path, directory, config, skip_crc32=False):
+    """
+    Extracts the members of a ZIP file that match the boundary set's `basename`,
+    flattening the hierarchy, and extracts the KML file from any KMZ member to
+    data.kml. Returns the paths of the extracted files other than KML files, and
+    the number of bytes extracted.
+    """
+    paths = []
+    size = 0
+    with open(path, 'rb') as f:
+        zip_file = ZipFile(f)
+        for info in zip_file.infolist():
+            basename = target(info.filename, config)
+            if basename is None:
+                continue
+
+            if basename == 'data.kmz':
+                with tempfile.SpooledTemporaryFile(spool_size) as kmz:
+                    for chunk in read_member(zip_file, f, info, skip_crc32):
+                        kmz.write(chunk)
+                    kmz.seek(0)
+                    try:
+                        size += extract_kml(kmz, directory, skip_crc32)
+                    except BadZipfile as e:
+                        raise BadZipfile('Bad KMZ file %s: %s' % (info.filename, e))
+                continue
+
+            member_path = os.path.join(directory, basename)
+            with open(member_path, 'wb') as out:
+                for chunk in read_member(zip_file, f, info, skip_crc32):
+                    out.write(chunk)
+                    size += len(chunk)
+            if basename != 'data.kml':
+                paths.append(member_path)
+    return paths, size
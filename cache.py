@@ -0,0 +1,88 @@
+# coding: utf-8
+import hashlib
+import os
+import os.path
+import pickle
+import tempfile
+
+"""
+The directory in which derived data is cached between runs. It is safe to
+delete at any time.
+"""
+cache_directory = os.environ.get('REPRESENT_CACHE_DIR', os.path.join(os.path.abspath(os.path.dirname(__file__)), '.cache'))
+
+
+def cache_path(*parts):
+    """
+    Returns a path within the cache directory, creating its parent directory.
+    """
+    path = os.path.join(cache_directory, *parts)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+
+def cache_key(*values):
+    """
+    Returns a filename-safe key for the given values.
+    """
+    return hashlib.sha1('\0'.join(str(value) for value in values).encode('utf-8')).hexdigest()
+
+
+def digest(path, algorithm='sha1'):
+    """
+    Returns the hex digest of a file's contents.
+    """
+    hasher = hashlib.new(algorithm)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def cached_digest(path, digests):
+    """
+    Returns the hex digest of a file's contents, reading the file only if its
+    size or modification time differs from its entry in `digests`, a mapping of
+    paths to sizes, modification times and digests, which is updated.
+    """
+    stat = os.stat(path)
+    entry = digests.get(path)
+    if entry and entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+        return entry[2]
+    value = digest(path)
+    digests[path] = (stat.st_size, stat.st_mtime_ns, value)
+    return value
+
+
+def load(path, default=None):
+    """
+    Reads a pickled cache file, or returns the default if it is missing or unreadable.
+    """
+    try:
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError, IndexError, TypeError, ValueError):
+        return default
+
+
+def dump(path, obj):
+    """
+    Writes a pickled cache file atomically.
+    """
+    write(path, pickle.dumps(obj, pickle.HIGHEST_PROTOCOL))
+
+
+def write(path, data):
+    """
+    Writes a cache file atomically, so that concurrent readers never see a
+    partial file.
+    """
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
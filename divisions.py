@@ -0,0 +1,239 @@
+# coding: utf-8
+import csv
+import mmap
+import os
+import os.path
+import struct
+
+from cache import cache_key, cache_path, digest, write
+
+"""
+The columns of country-ca.csv that are stored in the index, besides the ID and
+name. The type is derived from the ID.
+"""
+attributes = ('sgc', 'classification', 'has_children', 'organization_name')
+
+"""
+The index file starts with a header, followed by fixed-width records sorted by
+ID, the record numbers of the records' children, the offsets of the interned
+strings, and the UTF-8 encoded strings.
+
+A record contains the string numbers of the ID, name, type and attributes, the
+record number of the parent (or -1), and the range of the record's children.
+The parent is the CSV's `parent_id` or, if empty, the ID's prefix.
+"""
+HEADER = struct.Struct('<4sI20sQqIII')
+RECORD = struct.Struct('<%dIiII' % (3 + len(attributes)))
+UINT = struct.Struct('<I')
+MAGIC = b'OCDX'
+VERSION = 2
+
+indexes = {}
+
+
+class IndexedDivision(object):
+    """
+    A division in a `DivisionIndex`, with the same interface as the `Division`
+    class of `opencivicdata.divisions` for the attributes in the index.
+    """
+    __slots__ = ('index', 'number')
+
+    def __init__(self, index, number):
+        self.index = index
+        self.number = number
+
+    def __eq__(self, other):
+        return isinstance(other, IndexedDivision) and self.index is other.index and self.number == other.number
+
+    def __hash__(self):
+        return hash(self.number)
+
+    def __repr__(self):
+        return '<IndexedDivision %s>' % self.id
+
+    def __str__(self):
+        return '%s - %s' % (self.id, self.name)
+
+    @property
+    def id(self):
+        return self.index.string(self.index.record(self.number)[0])
+
+    @property
+    def name(self):
+        return self.index.string(self.index.record(self.number)[1])
+
+    @property
+    def _type(self):
+        return self.index.string(self.index.record(self.number)[2])
+
+    @property
+    def attrs(self):
+        record = self.index.record(self.number)
+        return {key: self.index.string(record[3 + i]) for i, key in enumerate(attributes)}
+
+    @property
+    def parent(self):
+        parent = self.index.record(self.number)[-3]
+        if parent == -1:
+            return None
+        return IndexedDivision(self.index, parent)
+
+    def children(self, _type=None):
+        start, count = self.index.record(self.number)[-2:]
+        for i in range(start, start + count):
+            child = IndexedDivision(self.index, self.index.child(i))
+            if not _type or child._type == _type:
+                yield child
+
+
+class DivisionIndex(object):
+    """
+    A memory-mapped index of an OCD-ID CSV file.
+    """
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (_, _, self.sha1, self.size, self.mtime, self.count, child_count, string_count) = HEADER.unpack_from(self.buffer, 0)
+        self.children_offset = HEADER.size + self.count * RECORD.size
+        self.strings_offset = self.children_offset + child_count * UINT.size
+        self.blob_offset = self.strings_offset + (string_count + 1) * UINT.size
+        self.strings = {}
+
+    def __len__(self):
+        return self.count
+
+    def record(self, number):
+        return RECORD.unpack_from(self.buffer, HEADER.size + number * RECORD.size)
+
+    def child(self, i):
+        return UINT.unpack_from(self.buffer, self.children_offset + i * UINT.size)[0]
+
+    def string(self, number):
+        value = self.strings.get(number)
+        if value is None:
+            start, end = struct.unpack_from('<II', self.buffer, self.strings_offset + number * UINT.size)
+            value = self.buffer[self.blob_offset + start:self.blob_offset + end].decode('utf-8')
+            self.strings[number] = value
+        return value
+
+    def find(self, division_id):
+        """
+        Returns the record number of the division, or -1.
+        """
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            value = self.string(self.record(middle)[0])
+            if value < division_id:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.count and self.string(self.record(low)[0]) == division_id:
+            return low
+        return -1
+
+    def get(self, division_id):
+        """
+        Returns the division with the OCD identifier.
+        """
+        number = self.find(division_id)
+        if number == -1:
+            raise ValueError('Division not found: %s' % division_id)
+        return IndexedDivision(self, number)
+
+    def all(self, *types):
+        """
+        Yields all divisions, or all divisions of the given types, sorted by ID.
+        """
+        for number in range(self.count):
+            division = IndexedDivision(self, number)
+            if not types or division._type in types:
+                yield division
+
+
+def build(csv_path, sha1, size, mtime):
+    """
+    Returns the contents of an index file for an OCD-ID CSV file.
+    """
+    with open(csv_path, encoding='utf-8') as f:
+        rows = sorted((row for row in csv.DictReader(f)), key=lambda row: row['id'])
+
+    strings = {}
+
+    def intern(value):
+        if value not in strings:
+            strings[value] = len(strings)
+        return strings[value]
+
+    numbers = {row['id']: number for number, row in enumerate(rows)}
+    children = [[] for row in rows]
+    parents = []
+    for number, row in enumerate(rows):
+        parent = numbers.get(row.get('parent_id') or row['id'].rsplit('/', 1)[0], -1)
+        if parent != -1:
+            children[parent].append(number)
+        parents.append(parent)
+
+    records = []
+    child_numbers = []
+    for number, row in enumerate(rows):
+        _type = row['id'].rsplit('/', 1)[1].split(':')[0]
+        values = [intern(row['id']), intern(row['name']), intern(_type)]
+        values.extend(intern(row.get(key) or '') for key in attributes)
+        values.extend([parents[number], len(child_numbers), len(children[number])])
+        records.append(RECORD.pack(*values))
+        child_numbers.extend(children[number])
+
+    blob = []
+    offsets = [0]
+    for value in strings:  # dicts preserve insertion order
+        encoded = value.encode('utf-8')
+        blob.append(encoded)
+        offsets.append(offsets[-1] + len(encoded))
+
+    return b''.join([
+        HEADER.pack(MAGIC, VERSION, bytes.fromhex(sha1), size, mtime, len(rows), len(child_numbers), len(strings)),
+        b''.join(records),
+        b''.join(UINT.pack(number) for number in child_numbers),
+        b''.join(UINT.pack(offset) for offset in offsets),
+        b''.join(blob),
+    ])
+
+
+def division_index(csv_path):
+    """
+    Returns the index of an OCD-ID CSV file, building it if it is missing or if
+    the CSV file changed.
+    """
+    stat = os.stat(csv_path)
+    index = indexes.get(csv_path)
+    if index and index.size == stat.st_size and index.mtime == stat.st_mtime_ns:
+        return index
+
+    index_path = cache_path('divisions', '%s.idx' % cache_key(os.path.realpath(csv_path)))
+
+    index = None
+    sha1 = None
+    if os.path.exists(index_path):
+        with open(index_path, 'rb') as f:
+            header = f.read(HEADER.size)
+        if len(header) == HEADER.size:
+            magic, version, stored_sha1, size, mtime = HEADER.unpack(header)[:5]
+            if magic == MAGIC and version == VERSION:
+                # Trust the size and modification time, or else compare the hash.
+                if size == stat.st_size and mtime == stat.st_mtime_ns:
+                    index = DivisionIndex(index_path)
+                else:
+                    sha1 = digest(csv_path)
+                    if stored_sha1.hex() == sha1:
+                        index = DivisionIndex(index_path)
+
+    if index is None:
+        write(index_path, build(csv_path, sha1 or digest(csv_path), stat.st_size, stat.st_mtime_ns))
+        index = DivisionIndex(index_path)
+
+    # Don't re-check the hash in this process if only the modification time changed.
+    index.size = stat.st_size
+    index.mtime = stat.st_mtime_ns
+    indexes[csv_path] = index
+    return index
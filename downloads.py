@@ -0,0 +1,444 @@
+# coding: utf-8
+import ftplib
+import hashlib
+import io
+import os
+import os.path
+import re
+import shutil
+import struct
+import sys
+import threading
+import time
+from collections import namedtuple
+from zipfile import BadZipfile, ZipFile
+
+import requests
+
+from archives import target
+from cache import cache_key, cache_path, dump, load
+from remote import timeout
+
+"""
+The number of bytes to read from a download at a time.
+"""
+chunk_size = 1 << 20
+
+"""
+A completed download: the path to the file, its size in bytes, its SHA-256
+hex digest, and the seconds it took to download.
+"""
+Download = namedtuple('Download', ['path', 'size', 'sha256', 'seconds'])
+
+
+"""
+A ZIP central directory file header, and end of central directory record.
+"""
+CENTRAL_HEADER = struct.Struct('<4s4B4HL2L5H2L')
+END_RECORD = struct.Struct('<4s4H2LH')
+
+
+class IncompleteDownload(Exception):
+    pass
+
+
+class PartialUnsupported(Exception):
+    """
+    Raised if a remote ZIP file can't be partially downloaded.
+    """
+
+
+class RangeFile(io.RawIOBase):
+    """
+    A read-only file object for a remote file, that reads with HTTP Range
+    requests. The end of the file, where a ZIP file's central directory is, is
+    read with the first request.
+    """
+    block_size = 1 << 16
+
+    def __init__(self, session, url, size, headers=None, **arguments):
+        self.session = session
+        self.url = url
+        self.size = size
+        self.headers = headers or {}
+        self.arguments = arguments
+        self.position = 0
+        self.block = (0, b'')
+        self.fetch(max(size - self.block_size, 0), self.block_size)
+
+    def fetch(self, start, length):
+        end = min(start + length, self.size) - 1
+        headers = dict(self.headers, **{'Range': 'bytes=%d-%d' % (start, end), 'Accept-Encoding': 'identity'})
+        response = self.session.get(self.url, headers=headers, timeout=timeout, **self.arguments)
+        if response.status_code != 206 or content_range_start(response) != start or len(response.content) != end - start + 1:
+            raise PartialUnsupported('Range requests not supported %s' % self.url)
+        self.block = (start, response.content)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self.position = offset
+        return self.position
+
+    def readinto(self, b):
+        length = min(len(b), self.size - self.position)
+        if length <= 0:
+            return 0
+        start, data = self.block
+        if not (start <= self.position and self.position + length <= start + len(data)):
+            self.fetch(self.position, max(length, self.block_size))
+            start, data = self.block
+        offset = self.position - start
+        b[:length] = data[offset:offset + length]
+        self.position += length
+        return length
+
+
+"""
+The locks that prevent a URL from being downloaded by multiple threads at once,
+as its downloads share a state file, by URL.
+"""
+url_locks = {}
+url_locks_lock = threading.Lock()
+
+
+def url_lock(url):
+    with url_locks_lock:
+        return url_locks.setdefault(url, threading.RLock())
+
+
+def state_path(url):
+    """
+    Returns the path to the file in which what is known about a URL's downloads
+    is stored: the validator of a partial download, and the ETag, size and hash
+    of the last complete download.
+    """
+    return cache_path('downloads', '%s.pickle' % cache_key(url))
+
+
+def load_state(url):
+    return load(state_path(url), {})
+
+
+def save_state(url, state):
+    dump(state_path(url), state)
+
+
+def target_path(url, directory):
+    """
+    Returns the path to the file in which what is known about the data files of
+    a URL that are processed into a directory is stored: the hash of the archive
+    last processed, the validator of a download that was unchanged, and the
+    ETag and last updated date with which to send conditional requests.
+    Boundary sets in different directories may share a URL.
+    """
+    return cache_path('targets', '%s.pickle' % cache_key(url, directory))
+
+
+def load_target(url, directory):
+    return load(target_path(url, directory), {})
+
+
+def save_target(url, directory, state):
+    dump(target_path(url, directory), state)
+
+
+def partial(path, hasher):
+    """
+    Returns the size of a partial download, after adding its contents to the hash.
+    """
+    size = 0
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                hasher.update(chunk)
+                size += len(chunk)
+    return size
+
+
+def report(url, download):
+    megabytes = download.size / 1048576
+    sys.stdout.write('Downloaded %.1f MB in %.1fs (%.1f MB/s) %s\n' % (megabytes, download.seconds, megabytes / max(download.seconds, 0.001), url))
+
+
+def download_http(session, url, path, headers=None, retries=3, conditions=None, respond=None, **arguments):
+    """
+    Downloads a file over HTTP to `path`, resuming an interrupted download, and
+    returns a `Download`, or None if the file wasn't downloaded.
+
+    The file is written to `path` + ".part" and renamed once its length matches
+    the Content-Length header. The partial file is resumed with a Range request,
+    if the server supports it and if the remote file didn't change.
+
+    `conditions` are conditional request headers: if the server responds with
+    304 Not Modified, the file isn't downloaded. `respond` is called with the
+    first successful response, and returns the path to which to rename the
+    file, or None to not download it.
+    """
+    # Downloads of the same URL share a state file.
+    with url_lock(url):
+        part_path = '%s.part' % path
+        state = load_state(url)
+        started = time.time()
+        responded = False
+
+        for attempt in range(retries + 1):
+            hasher = hashlib.sha256()
+            offset = partial(part_path, hasher)
+
+            request_headers = dict(headers or {})
+            if not responded:
+                request_headers.update(conditions or {})
+            # Compressed responses would make the Content-Length and ranges refer to other bytes.
+            request_headers['Accept-Encoding'] = 'identity'
+            validator = state.get('partial')
+            if offset and validator:
+                request_headers['Range'] = 'bytes=%d-' % offset
+                request_headers['If-Range'] = validator
+
+            try:
+                response = session.get(url, headers=request_headers, stream=True, timeout=timeout, **arguments)
+                try:
+                    if response.status_code == 304 and conditions and not responded:
+                        return None
+                    elif response.status_code == 416 or response.status_code == 206 and content_range_start(response) != offset:
+                        os.unlink(part_path)
+                        raise IncompleteDownload('Unexpected range %s' % url)
+                    elif response.status_code == 206:
+                        mode = 'ab'
+                    else:
+                        response.raise_for_status()
+                        hasher = hashlib.sha256()
+                        offset = 0
+                        mode = 'wb'
+
+                    if respond and not responded:
+                        path = respond(response)
+                        if path is None:
+                            return None
+                    responded = True
+
+                    # Only a strong ETag or a Last-Modified header can be used to resume.
+                    etag = response.headers.get('ETag')
+                    if etag and not etag.startswith('W/'):
+                        state['partial'] = etag
+                    else:
+                        state['partial'] = response.headers.get('Last-Modified')
+                    save_state(url, state)
+
+                    expected = None
+                    if response.headers.get('Content-Length') and not response.headers.get('Content-Encoding'):
+                        expected = offset + int(response.headers['Content-Length'])
+
+                    size = offset
+                    with open(part_path, mode) as f:
+                        for chunk in response.iter_content(chunk_size=chunk_size):
+                            f.write(chunk)
+                            hasher.update(chunk)
+                            size += len(chunk)
+                finally:
+                    response.close()
+
+                if expected is not None and size != expected:
+                    raise IncompleteDownload('Expected %d bytes, got %d %s' % (expected, size, url))
+            except requests.exceptions.SSLError:
+                # A certificate error is not transient, and the caller may retry without verification.
+                raise
+            except (IncompleteDownload, requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError, requests.exceptions.Timeout):
+                if attempt == retries:
+                    raise
+                continue
+
+            state['etag'] = etag
+            return finish(url, state, part_path, path, size, hasher.hexdigest(), started)
+
+
+def download_ftp(ftp, url, remote_path, path, modified=None):
+    """
+    Downloads a file over an FTP connection to `path`, resuming an interrupted
+    download, and returns a `Download`. `modified` is the response to an MDTM
+    command for the file, if already sent.
+    """
+    # Downloads of the same URL share a state file.
+    with url_lock(url):
+        part_path = '%s.part' % path
+        state = load_state(url)
+        started = time.time()
+
+        hasher = hashlib.sha256()
+        # Resume only if the remote file didn't change.
+        if modified is None:
+            modified = ftp.sendcmd('MDTM %s' % remote_path)
+        if state.get('partial') == modified:
+            offset = partial(part_path, hasher)
+        else:
+            offset = 0
+        state['partial'] = modified
+        save_state(url, state)
+
+        try:
+            ftp.voidcmd('TYPE I')
+            expected = ftp.size(remote_path)
+        except ftplib.error_perm:
+            expected = None
+
+        with open(part_path, 'ab' if offset else 'wb') as f:
+            def write(chunk):
+                f.write(chunk)
+                hasher.update(chunk)
+            ftp.retrbinary('RETR %s' % remote_path, write, blocksize=chunk_size, rest=offset or None)
+        size = os.path.getsize(part_path)
+
+        if expected is not None and size != expected:
+            raise IncompleteDownload('Expected %d bytes, got %d %s' % (expected, size, url))
+
+        return finish(url, state, part_path, path, size, hasher.hexdigest(), started)
+
+
+def content_range_start(response):
+    match = re.match(r'bytes (\d+)-', response.headers.get('Content-Range', ''))
+    if match:
+        return int(match.group(1))
+    return None
+
+
+def finish(url, state, part_path, path, size, sha256, started):
+    os.replace(part_path, path)
+    state.pop('partial', None)
+    state['sha256'] = sha256
+    state['size'] = size
+    save_state(url, state)
+
+    download = Download(path, size, sha256, time.time() - started)
+    report(url, download)
+    return download
+
+
+def archive(download):
+    """
+    Adds a download to the content-addressed store of archives, and returns its
+    path in the store.
+    """
+    extension = os.path.splitext(download.path)[1]
+    path = cache_path('archives', '%s%s' % (download.sha256, extension))
+    if not os.path.exists(path):
+        try:
+            os.link(download.path, path)
+        except OSError:
+            shutil.copyfile(download.path, path)
+    return path
+
+
+def mark_processed(url, directory, sha256):
+    """
+    Records that the archive with the given hash was processed from the URL into
+    the directory, and removes the previously processed archive from the store,
+    unless it was last processed for another URL or directory.
+    """
+    state = load_target(url, directory)
+    previous = state.get('processed')
+    state['processed'] = sha256
+    state.pop('unchanged', None)
+    save_target(url, directory, state)
+
+    if previous and previous != sha256:
+        directory = os.path.dirname(target_path(url, directory))
+        for name in os.listdir(directory):
+            if name.endswith('.pickle') and load(os.path.join(directory, name), {}).get('processed') == previous:
+                return
+        directory = os.path.dirname(cache_path('archives', previous))
+        for name in os.listdir(directory):
+            if name.startswith(previous):
+                os.unlink(os.path.join(directory, name))
+
+
+def download_members(session, url, path, size, config, headers=None, **arguments):
+    """
+    Downloads only the members of a remote ZIP file that would be extracted for
+    the boundary set, using HTTP Range requests, and writes them to a ZIP file at
+    `path`. Returns a `Download`, or None if the ZIP file's layout or the server
+    isn't supported.
+    """
+    # Downloads of the same URL share a state file.
+    with url_lock(url):
+        part_path = '%s.part' % path
+        started = time.time()
+
+        try:
+            remote = RangeFile(session, url, size, headers=headers, **arguments)
+            zip_file = ZipFile(remote)
+
+            # Find the central directory. ZIP64 files aren't supported.
+            end_offset = size - END_RECORD.size - len(zip_file.comment)
+            remote.seek(end_offset - 20)
+            if remote.read(4) == b'PK\x06\x07':
+                raise PartialUnsupported('ZIP64 file %s' % url)
+            remote.seek(zip_file.start_dir)
+            directory = remote.read(end_offset - zip_file.start_dir)
+
+            # A member's data ends where the next member or the central directory starts.
+            offsets = sorted(set(info.header_offset for info in zip_file.infolist()) | {zip_file.start_dir})
+            ends = dict(zip(offsets, offsets[1:]))
+
+            hasher = hashlib.sha256()
+            records = []
+            written = 0
+            position = 0
+            with open(part_path, 'wb') as f:
+                def write(data):
+                    f.write(data)
+                    hasher.update(data)
+
+                for info in zip_file.infolist():
+                    fields = list(CENTRAL_HEADER.unpack_from(directory, position))
+                    if fields[0] != b'PK\x01\x02':
+                        raise BadZipfile('Bad central directory %s' % url)
+                    length = CENTRAL_HEADER.size + fields[12] + fields[13] + fields[14]
+                    record = directory[position:position + length]
+                    position += length
+
+                    if target(info.filename, config) is None:
+                        continue
+                    if 0xFFFFFFFF in (fields[10], fields[11], fields[-1]):
+                        raise PartialUnsupported('ZIP64 member %s' % url)
+
+                    # Copy the local file header, data and data descriptor as-is.
+                    end = ends[info.header_offset] - 1
+                    response = session.get(url, headers=dict(headers or {}, **{'Range': 'bytes=%d-%d' % (info.header_offset, end), 'Accept-Encoding': 'identity'}), stream=True, timeout=timeout, **arguments)
+                    try:
+                        if response.status_code != 206 or content_range_start(response) != info.header_offset:
+                            raise PartialUnsupported('Range requests not supported %s' % url)
+                        fields[-1] = written
+                        count = 0
+                        for chunk in response.iter_content(chunk_size=chunk_size):
+                            write(chunk)
+                            count += len(chunk)
+                    finally:
+                        response.close()
+                    if count != end - info.header_offset + 1:
+                        raise IncompleteDownload('Expected %d bytes, got %d %s' % (end - info.header_offset + 1, count, url))
+
+                    records.append(CENTRAL_HEADER.pack(*fields) + record[CENTRAL_HEADER.size:])
+                    written += count
+
+                central_directory = b''.join(records)
+                write(central_directory)
+                write(END_RECORD.pack(b'PK\x05\x06', 0, 0, len(records), len(records), len(central_directory), written, 0))
+        except (PartialUnsupported, BadZipfile):
+            if os.path.exists(part_path):
+                os.unlink(part_path)
+            return None
+
+        sys.stdout.write('Downloaded %d of %d members %s\n' % (len(records), len(zip_file.infolist()), url))
+        return finish(url, load_state(url), part_path, path, os.path.getsize(part_path), hasher.hexdigest(), started)
@@ -0,0 +1,689 @@
+# coding: utf-8
+import os
+import pickle
+import struct
+import tempfile
+from collections import namedtuple
+from datetime import date
+
+"""
+Shapefile shape types.
+
+@see https://www.esri.com/library/whitepapers/pdfs/shapefile.pdf
+"""
+NULL = 0
+POLYGON = 5
+POLYGONZ = 15
+POLYGONM = 25
+
+"""
+The names of shapefile shape types.
+"""
+shape_types = {
+    0: 'Null',
+    1: 'Point',
+    3: 'PolyLine',
+    5: 'Polygon',
+    8: 'MultiPoint',
+    11: 'PointZ',
+    13: 'PolyLineZ',
+    15: 'PolygonZ',
+    18: 'MultiPointZ',
+    21: 'PointM',
+    23: 'PolyLineM',
+    25: 'PolygonM',
+    28: 'MultiPointM',
+    31: 'MultiPatch',
+}
+
+"""
+The big-endian part of a .shp or .shx file header: file code, five unused
+integers and file length in 16-bit words.
+"""
+FILE_HEADER = struct.Struct('>7i')
+
+"""
+The little-endian part of a .shp or .shx file header: version, shape type and
+bounding box (X, Y, Z and M ranges).
+"""
+SHAPE_HEADER = struct.Struct('<2i8d')
+
+"""
+A .shp record header (record number and content length in 16-bit words) or a
+.shx record (offset and content length in 16-bit words).
+"""
+RECORD_HEADER = struct.Struct('>2i')
+
+"""
+A polygon's shape type, bounding box, number of parts and number of points.
+"""
+POLYGON_HEADER = struct.Struct('<i4d2i')
+
+"""
+A .dbf file header: version, date of last update, number of records, length of
+header and length of record.
+"""
+DBF_HEADER = struct.Struct('<4BL2H20x')
+
+"""
+A .dbf field descriptor: name, type, length and decimal count.
+"""
+DBF_FIELD = struct.Struct('<11sc4x2B14x')
+
+"""
+The length in bytes of the .shp and .shx file headers.
+"""
+HEADER_SIZE = FILE_HEADER.size + SHAPE_HEADER.size
+
+"""
+The maximum length of a .dbf character field.
+"""
+MAX_FIELD_LENGTH = 254
+
+"""
+A .dbf field: its name, type, length and decimal count.
+"""
+Field = namedtuple('Field', ['name', 'type', 'length', 'decimals'])
+
+"""
+A .dbf file's number of records, header length, record length and fields.
+"""
+DBFHeader = namedtuple('DBFHeader', ['count', 'header_length', 'record_length', 'fields'])
+
+"""
+The .prj file contents for longitude and latitude on the WGS 84 datum, as
+written by ogr2ogr.
+"""
+WGS84_PRJ = 'GEOGCS["GCS_WGS_1984",DATUM["D_WGS_1984",SPHEROID["WGS_84",6378137,298.257223563]],PRIMEM["Greenwich",0],UNIT["Degree",0.017453292519943295]]'
+
+
+class ShapefileError(Exception):
+    """
+    Raised if a shapefile is malformed or shapefiles can't be combined.
+    """
+
+
+def read_shape_header(f):
+    """
+    Returns a .shp or .shx file's length in bytes, shape type and bounding box.
+    """
+    data = f.read(HEADER_SIZE)
+    if len(data) != HEADER_SIZE:
+        raise ShapefileError('Truncated header in %s' % f.name)
+    header = FILE_HEADER.unpack(data[:FILE_HEADER.size])
+    if header[0] != 9994:
+        raise ShapefileError('Bad file code in %s' % f.name)
+    shape_header = SHAPE_HEADER.unpack(data[FILE_HEADER.size:])
+    return header[-1] * 2, shape_header[1], shape_header[2:]
+
+
+def iter_shapes(f):
+    """
+    Yields the contents of a .shp file's records, after its header.
+    """
+    while True:
+        data = f.read(RECORD_HEADER.size)
+        if not data:
+            return
+        if len(data) != RECORD_HEADER.size:
+            raise ShapefileError('Truncated record header in %s' % f.name)
+        length = RECORD_HEADER.unpack(data)[1] * 2
+        content = f.read(length)
+        if len(content) != length:
+            raise ShapefileError('Truncated record in %s' % f.name)
+        yield content
+
+
+def read_dbf_header(f):
+    """
+    Returns a .dbf file's `DBFHeader`, leaving the file at its first record.
+    """
+    data = f.read(DBF_HEADER.size)
+    if len(data) != DBF_HEADER.size:
+        raise ShapefileError('Truncated header in %s' % f.name)
+    header = DBF_HEADER.unpack(data)
+    fields = []
+    for i in range((header[5] - DBF_HEADER.size - 1) // DBF_FIELD.size):
+        data = f.read(DBF_FIELD.size)
+        if len(data) != DBF_FIELD.size or data[0:1] == b'\r':
+            break
+        name, type, length, decimals = DBF_FIELD.unpack(data)
+        fields.append(Field(name.split(b'\0', 1)[0].decode('latin-1'), type.decode('latin-1'), length, decimals))
+    f.seek(header[5])
+    return DBFHeader(header[4], header[5], header[6], fields)
+
+
+def iter_dbf_records(f, header):
+    """
+    Yields a .dbf file's records, including their deletion flags.
+    """
+    for i in range(header.count):
+        record = f.read(header.record_length)
+        if len(record) != header.record_length:
+            raise ShapefileError('Truncated record in %s' % f.name)
+        yield record
+
+
+def widen(field, other):
+    """
+    Returns a .dbf field that can hold the values of both fields.
+    """
+    if field.type in 'NF' and other.type in 'NF':
+        decimals = max(field.decimals, other.decimals)
+        digits = max(field.length - field.decimals - bool(field.decimals), other.length - other.decimals - bool(other.decimals))
+        return Field(field.name, field.type if field.type == other.type else 'N', digits + decimals + bool(decimals), decimals)
+    if field.type == other.type:
+        return Field(field.name, field.type, max(field.length, other.length), field.decimals)
+    # Fields of different types are merged as character fields.
+    return Field(field.name, 'C', min(max(field.length, other.length, 10), MAX_FIELD_LENGTH), 0)
+
+
+def convert(value, source, target):
+    """
+    Returns a .dbf value of a `source` field, as a value of a `target` field.
+    """
+    if source == target:
+        return value
+    value = value.strip()
+    if target.type in 'NF':
+        if value and source.decimals != target.decimals:
+            try:
+                value = ('%.*f' % (target.decimals, float(value))).encode('ascii')
+            except ValueError:
+                pass
+        return value[:target.length].rjust(target.length)
+    return value[:target.length].ljust(target.length)
+
+
+def union(bbox, other):
+    """
+    Returns the union of two .shp bounding boxes.
+    """
+    # The minimums are the X, Y, Z and M minimums.
+    return tuple(min(a, b) if i in (0, 1, 4, 6) else max(a, b) for i, (a, b) in enumerate(zip(bbox, other)))
+
+
+def read_text(path):
+    """
+    Returns the contents of a file with its whitespace collapsed, or None if it
+    doesn't exist.
+    """
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            return b' '.join(f.read().split())
+
+
+def merge_shapefiles(paths, path):
+    """
+    Merges shapefiles into one shapefile in a single pass, and returns the paths
+    of the files written. `paths` and `path` are paths to shapefiles without
+    their extensions. `path` may be one of `paths`.
+
+    The fields of the .dbf files are merged by name, ignoring case, and widened
+    to hold the values of every file. The shapefiles must have the same shape
+    type, and their .prj and .cpg files must be the same.
+    """
+    shape_type = None
+    bbox = None
+    headers = []
+    fields = []
+    indices = {}
+    for basename in paths:
+        with open('%s.shp' % basename, 'rb') as f:
+            _, input_shape_type, input_bbox = read_shape_header(f)
+        if input_shape_type != NULL:
+            if shape_type is None:
+                shape_type = input_shape_type
+            elif input_shape_type != shape_type:
+                raise ShapefileError('Expected shape type %d not %d in %s.shp' % (shape_type, input_shape_type, basename))
+            if bbox is None:
+                bbox = input_bbox
+            else:
+                bbox = union(bbox, input_bbox)
+
+        with open('%s.dbf' % basename, 'rb') as f:
+            header = read_dbf_header(f)
+        headers.append(header)
+        for field in header.fields:
+            key = field.name.lower()
+            if key in indices:
+                fields[indices[key]] = widen(fields[indices[key]], field)
+            else:
+                indices[key] = len(fields)
+                fields.append(field)
+
+    extras = {}
+    for extension in ('prj', 'cpg'):
+        values = {}
+        for basename in paths:
+            value = read_text('%s.%s' % (basename, extension))
+            if value is not None:
+                values[basename] = value
+        if len(set(values.values())) > 1:
+            raise ShapefileError('Expected the same .%s file in %s' % (extension, ', '.join(sorted(values))))
+        if values:
+            extras[extension] = '%s.%s' % (next(iter(values)), extension)
+
+    outputs = ['%s.%s' % (path, extension) for extension in ['dbf', 'shp', 'shx'] + sorted(extras)]
+    parts = ['%s.part' % output for output in outputs]
+    shape_type = shape_type or NULL
+    bbox = bbox or (0,) * 8
+    record_length = 1 + sum(field.length for field in fields)
+    header_length = DBF_HEADER.size + DBF_FIELD.size * len(fields) + 1
+    today = date.today()
+
+    try:
+        with open(parts[0], 'wb') as dbf, open(parts[1], 'wb') as shp, open(parts[2], 'wb') as shx:
+            shp.write(b'\0' * HEADER_SIZE)
+            shx.write(b'\0' * HEADER_SIZE)
+            dbf.write(b'\0' * DBF_HEADER.size)
+            for field in fields:
+                dbf.write(DBF_FIELD.pack(field.name.encode('latin-1'), field.type.encode('latin-1'), field.length, field.decimals))
+            dbf.write(b'\r')
+
+            number = 0
+            for basename, header in zip(paths, headers):
+                # Map the output's fields to the input's values.
+                slices = {}
+                offset = 1
+                for field in header.fields:
+                    slices[field.name.lower()] = (offset, offset + field.length, field)
+                    offset += field.length
+                mapping = [(slices.get(field.name.lower()), field) for field in fields]
+
+                with open('%s.shp' % basename, 'rb') as shp_in, open('%s.dbf' % basename, 'rb') as dbf_in:
+                    read_shape_header(shp_in)
+                    read_dbf_header(dbf_in)
+                    records = iter_dbf_records(dbf_in, header)
+                    count = 0
+                    for content in iter_shapes(shp_in):
+                        record = next(records, None)
+                        if record is None:
+                            raise ShapefileError('Expected %d records in %s.shp' % (header.count, basename))
+                        count += 1
+                        shx.write(RECORD_HEADER.pack(shp.tell() // 2, len(content) // 2))
+                        shp.write(RECORD_HEADER.pack(number + count, len(content) // 2))
+                        shp.write(content)
+
+                        values = [record[0:1]]
+                        for source, target in mapping:
+                            if source is None:
+                                values.append(b' ' * target.length)
+                            else:
+                                values.append(convert(record[source[0]:source[1]], source[2], target))
+                        dbf.write(b''.join(values))
+                    if count != header.count:
+                        raise ShapefileError('Expected %d records in %s.dbf' % (count, basename))
+                number += count
+            dbf.write(b'\x1a')
+
+            for f in (shp, shx):
+                length = f.tell()
+                f.seek(0)
+                f.write(FILE_HEADER.pack(9994, 0, 0, 0, 0, 0, length // 2) + SHAPE_HEADER.pack(1000, shape_type, *bbox))
+            dbf.seek(0)
+            dbf.write(DBF_HEADER.pack(3, today.year - 1900, today.month, today.day, number, header_length, record_length))
+
+        for extension, part in zip(sorted(extras), parts[3:]):
+            with open(extras[extension], 'rb') as f, open(part, 'wb') as out:
+                out.write(f.read())
+    except Exception:
+        for part in parts:
+            if os.path.exists(part):
+                os.unlink(part)
+        raise
+
+    for part, output in zip(parts, outputs):
+        os.replace(part, output)
+    return outputs
+
+
+def flatten(path):
+    """
+    Rewrites a PolygonZ or PolygonM shapefile as a Polygon shapefile, and returns
+    its original shape type, or None if it isn't a PolygonZ or PolygonM
+    shapefile. `path` is the path to the shapefile without its extension.
+
+    Each record is copied without its Z and M ranges and arrays, and the .shx
+    file is rewritten. The .dbf file is unchanged.
+    """
+    shp_path = '%s.shp' % path
+    shx_path = '%s.shx' % path
+    with open(shp_path, 'rb') as f:
+        _, shape_type, bbox = read_shape_header(f)
+    if shape_type not in (POLYGONZ, POLYGONM):
+        return None
+
+    polygon = struct.pack('<i', POLYGON)
+    parts = ['%s.part' % shp_path, '%s.part' % shx_path]
+    try:
+        with open(shp_path, 'rb') as shp_in, open(parts[0], 'wb') as shp, open(parts[1], 'wb') as shx:
+            read_shape_header(shp_in)
+            shp.write(b'\0' * HEADER_SIZE)
+            shx.write(b'\0' * HEADER_SIZE)
+            number = 0
+            for content in iter_shapes(shp_in):
+                number += 1
+                # Slice the record without copying it.
+                view = memoryview(content)
+                if struct.unpack_from('<i', view)[0] == NULL:
+                    pieces = [view]
+                else:
+                    if len(view) < POLYGON_HEADER.size:
+                        raise ShapefileError('Truncated record %d in %s' % (number, shp_path))
+                    part_count, point_count = struct.unpack_from('<2i', view, POLYGON_HEADER.size - 8)
+                    end = POLYGON_HEADER.size + 4 * part_count + 16 * point_count
+                    if end > len(view):
+                        raise ShapefileError('Truncated record %d in %s' % (number, shp_path))
+                    pieces = [polygon, view[4:end]]
+                length = sum(len(piece) for piece in pieces)
+                shx.write(RECORD_HEADER.pack(shp.tell() // 2, length // 2))
+                shp.write(RECORD_HEADER.pack(number, length // 2))
+                for piece in pieces:
+                    shp.write(piece)
+
+            for f in (shp, shx):
+                length = f.tell()
+                f.seek(0)
+                f.write(FILE_HEADER.pack(9994, 0, 0, 0, 0, 0, length // 2) + SHAPE_HEADER.pack(1000, POLYGON, bbox[0], bbox[1], bbox[2], bbox[3], 0, 0, 0, 0))
+    except Exception:
+        for part in parts:
+            if os.path.exists(part):
+                os.unlink(part)
+        raise
+
+    os.replace(parts[0], shp_path)
+    os.replace(parts[1], shx_path)
+    return shape_type
+
+
+def kept_fields(header, names):
+    """
+    Returns the indices of a .dbf file's fields that are named, compared
+    case-insensitively. If no field is named, the first field is kept, as a
+    .dbf file must have a field.
+    """
+    keep = {name.lower() for name in names}
+    return [i for i, field in enumerate(header.fields) if field.name.lower() in keep] or [0]
+
+
+def drop_fields(path, names):
+    """
+    Rewrites a .dbf file with only the named fields (see `kept_fields`), and
+    returns the names of the dropped fields. The header and the kept fields'
+    values are copied byte for byte.
+    """
+    part = '%s.part' % path
+    with open(path, 'rb') as f:
+        header = read_dbf_header(f)
+        kept = kept_fields(header, names)
+        if len(kept) == len(header.fields):
+            return []
+
+        f.seek(0)
+        prefix = f.read(DBF_HEADER.size)
+        descriptors = [f.read(DBF_FIELD.size) for field in header.fields]
+        slices = []
+        offset = 1
+        for field in header.fields:
+            slices.append(slice(offset, offset + field.length))
+            offset += field.length
+
+        header_length = DBF_HEADER.size + DBF_FIELD.size * len(kept) + 1
+        record_length = 1 + sum(header.fields[i].length for i in kept)
+        try:
+            with open(part, 'wb') as out:
+                out.write(prefix[:8] + struct.pack('<2H', header_length, record_length) + prefix[12:])
+                for i in kept:
+                    out.write(descriptors[i])
+                out.write(b'\r')
+                f.seek(header.header_length)
+                for record in iter_dbf_records(f, header):
+                    out.write(record[:1] + b''.join(record[slices[i]] for i in kept))
+                out.write(b'\x1a')
+        except Exception:
+            if os.path.exists(part):
+                os.unlink(part)
+            raise
+
+    os.replace(part, path)
+    return [field.name for i, field in enumerate(header.fields) if i not in kept]
+
+
+def ring_area(ring):
+    """
+    Returns twice the signed area of a ring, which is negative if the ring is
+    clockwise.
+    """
+    area = 0
+    for i in range(len(ring) - 1):
+        area += ring[i][0] * ring[i + 1][1] - ring[i + 1][0] * ring[i][1]
+    return area
+
+
+def orient(ring, clockwise):
+    """
+    Returns a closed ring in the given direction.
+    """
+    if ring[0] != ring[-1]:
+        ring = ring + [ring[0]]
+    if (ring_area(ring) < 0) != clockwise:
+        ring = ring[::-1]
+    return ring
+
+
+def field_names(names):
+    """
+    Returns unique .dbf field names of at most 10 characters for the given names.
+    """
+    seen = set()
+    results = []
+    for name in names:
+        field = name[:10]
+        i = 1
+        while field.lower() in seen:
+            suffix = '_%d' % i
+            field = name[:10 - len(suffix)] + suffix
+            i += 1
+        seen.add(field.lower())
+        results.append(field)
+    return results
+
+
+def infer_field(name, values, encoding):
+    """
+    Returns a .dbf field that can hold the given values: a numeric field if all
+    are numbers, or a character field otherwise.
+    """
+    values = [value for value in values if value is not None]
+    if values and all(isinstance(value, int) and not isinstance(value, bool) for value in values):
+        return Field(name, 'N', max(len('%d' % value) for value in values), 0)
+    if values and all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in values):
+        return Field(name, 'N', 24, 15)
+    return Field(name, 'C', min(max([len(str(value).encode(encoding, 'replace')) for value in values] + [1]), MAX_FIELD_LENGTH), 0)
+
+
+def sample_value(sample, value, encoding):
+    """
+    Adds a value to a field's sample, keeping only the values that determine
+    the field that `infer_field` returns: the longest integer, a float, a value
+    that isn't a number, and the value with the longest text.
+    """
+    if value is None:
+        return
+    if isinstance(value, int) and not isinstance(value, bool):
+        if 'int' not in sample or len('%d' % value) > len('%d' % sample['int']):
+            sample['int'] = value
+    elif isinstance(value, float):
+        sample['float'] = value
+    else:
+        sample['other'] = value
+    length = len(str(value).encode(encoding, 'replace'))
+    if length > sample.get('length', 0):
+        sample['text'] = value
+        sample['length'] = length
+
+
+def format_value(value, field, encoding):
+    """
+    Returns a value as the bytes of a .dbf field.
+    """
+    if value is None:
+        return b' ' * field.length
+    if field.type == 'N' or field.type == 'F':
+        if field.decimals:
+            text = '%.*f' % (field.decimals, value)
+        else:
+            text = '%d' % value
+        if len(text) > field.length:
+            # Fit the value with less precision, or mark it as too large.
+            if '.' in text and text.index('.') < field.length:
+                text = text[:field.length].rstrip('.')
+            else:
+                text = '*' * field.length
+        return text.rjust(field.length).encode('ascii')
+    if field.type == 'D':
+        return value.strftime('%Y%m%d').encode('ascii')
+    if field.type == 'L':
+        return b'T' if value else b'F'
+    encoded = str(value).encode(encoding, 'replace')
+    if len(encoded) > field.length:
+        # Drop any character that the truncation splits.
+        encoded = encoded[:field.length].decode(encoding, 'ignore').encode(encoding, 'replace')
+    return encoded.ljust(field.length)
+
+
+def write_dbf_header(f, fields, count, encoding, modified=None):
+    """
+    Writes a .dbf file header. `modified` is the date of last update, if not
+    today.
+    """
+    modified = modified or date.today()
+    header_length = DBF_HEADER.size + DBF_FIELD.size * len(fields) + 1
+    record_length = 1 + sum(field.length for field in fields)
+    f.write(DBF_HEADER.pack(3, modified.year - 1900, modified.month, modified.day, count, header_length, record_length))
+    for name, field in zip(field_names([field.name for field in fields]), fields):
+        f.write(DBF_FIELD.pack(name.encode(encoding, 'replace'), field.type.encode('ascii'), field.length, field.decimals))
+    f.write(b'\r')
+
+
+class PolygonWriter(object):
+    """
+    Writes a polygon shapefile, one record at a time. Geometries are streamed to
+    the .shp file. If the .dbf fields are given, attributes are streamed to the
+    .dbf file; otherwise, they are spooled to a temporary file and written on
+    close, once the fields and their lengths are known.
+    """
+
+    def __init__(self, path, encoding='utf-8', prj=WGS84_PRJ, fields=None, modified=None):
+        """
+        `path` is the path to the shapefile without its extension. `fields` are
+        `Field`s named by the attributes' keys, which are shortened as needed.
+        `modified` is the date of last update written to the .dbf file.
+        """
+        self.path = path
+        self.encoding = encoding
+        self.prj = prj
+        self.fields = fields
+        self.modified = modified
+        self.samples = {}
+        self.names = []
+        self.records = None
+        self.offsets = []
+        self.bbox = None
+        self.shp = open('%s.shp' % path, 'wb')
+        self.shp.write(b'\0' * HEADER_SIZE)
+        if fields is None:
+            self.dbf = None
+            self.records = tempfile.TemporaryFile(dir=os.path.dirname(os.path.abspath(path)))
+        else:
+            self.dbf = open('%s.dbf' % path, 'wb')
+            write_dbf_header(self.dbf, fields, 0, encoding, modified)
+
+    def write(self, rings, attributes):
+        """
+        Writes a record. `rings` is a list of outer rings and their inner rings,
+        as lists of (x, y) points. `attributes` is a dict of strings, numbers or
+        dates.
+        """
+        offset = self.shp.tell()
+        if rings:
+            points = [point for ring in rings for point in ring]
+            xs = [x for x, y in points]
+            ys = [y for x, y in points]
+            bbox = (min(xs), min(ys), max(xs), max(ys))
+            if self.bbox is None:
+                self.bbox = bbox
+            else:
+                self.bbox = (min(self.bbox[0], bbox[0]), min(self.bbox[1], bbox[1]), max(self.bbox[2], bbox[2]), max(self.bbox[3], bbox[3]))
+
+            parts = []
+            index = 0
+            for ring in rings:
+                parts.append(index)
+                index += len(ring)
+            content = POLYGON_HEADER.pack(POLYGON, bbox[0], bbox[1], bbox[2], bbox[3], len(parts), len(points))
+            content += struct.pack('<%di' % len(parts), *parts)
+            content += struct.pack('<%dd' % (len(points) * 2), *(coordinate for point in points for coordinate in point))
+        else:
+            content = struct.pack('<i', NULL)
+
+        self.shp.write(RECORD_HEADER.pack(len(self.offsets) + 1, len(content) // 2))
+        self.shp.write(content)
+        self.offsets.append((offset // 2, len(content) // 2))
+
+        if self.dbf:
+            self.dbf.write(b' ' + b''.join(format_value(attributes.get(field.name), field, self.encoding) for field in self.fields))
+        else:
+            for name, value in attributes.items():
+                if name not in self.samples:
+                    self.samples[name] = {}
+                    self.names.append(name)
+                sample_value(self.samples[name], value, self.encoding)
+            pickle.dump(attributes, self.records, pickle.HIGHEST_PROTOCOL)
+
+    def header(self, length):
+        bbox = self.bbox or (0, 0, 0, 0)
+        return FILE_HEADER.pack(9994, 0, 0, 0, 0, 0, length // 2) + SHAPE_HEADER.pack(1000, POLYGON, bbox[0], bbox[1], bbox[2], bbox[3], 0, 0, 0, 0)
+
+    def close(self):
+        length = self.shp.tell()
+        self.shp.seek(0)
+        self.shp.write(self.header(length))
+        self.shp.close()
+
+        with open('%s.shx' % self.path, 'wb') as f:
+            f.write(self.header(HEADER_SIZE + RECORD_HEADER.size * len(self.offsets)))
+            for offset, length in self.offsets:
+                f.write(RECORD_HEADER.pack(offset, length))
+
+        if self.dbf:
+            self.dbf.write(b'\x1a')
+            self.dbf.seek(0)
+            write_dbf_header(self.dbf, self.fields, len(self.offsets), self.encoding, self.modified)
+            self.dbf.close()
+        else:
+            fields = [infer_field(name, [value for key, value in self.samples[name].items() if key != 'length'], self.encoding) for name in self.names]
+            self.records.seek(0)
+            with open('%s.dbf' % self.path, 'wb') as f:
+                write_dbf_header(f, fields, len(self.offsets), self.encoding, self.modified)
+                for _ in self.offsets:
+                    record = pickle.load(self.records)
+                    f.write(b' ' + b''.join(format_value(record.get(field.name), field, self.encoding) for field in fields))
+                f.write(b'\x1a')
+            self.records.close()
+
+        with open('%s.prj' % self.path, 'w') as f:
+            f.write(self.prj)
+
+    def paths(self):
+        """
+        Returns the paths to the shapefile's files.
+        """
+        return ['%s%s%s' % (self.path, os.extsep, extension) for extension in ('dbf', 'prj', 'shp', 'shx')]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,181 @@
+# coding: utf-8
+import os
+import os.path
+from collections import defaultdict
+
+from cache import cache_key, cached_digest, dump, load
+from loader import dirname
+from shapes import FieldNotRead, scan_dbf
+
+"""
+The functions with which a boundary set's features are named and identified,
+and their defaults in represent-boundaries.
+"""
+function_defaults = (
+    ('is_valid_func', lambda feature: True),
+    ('name_func', None),
+    ('id_func', lambda feature: ''),
+    ('slug_func', None),
+)
+
+
+def data_sources(directory):
+    """
+    Returns the paths to the .dbf files of the shapefiles that represent-boundaries
+    loads from a boundary set's directory, in order.
+    """
+    paths = []
+    for dirpath, dirnames, filenames in os.walk(directory, followlinks=True):
+        dirnames.sort()
+        for basename in sorted(filenames):
+            if basename.endswith('.dbf') and '_cleaned_' not in basename:
+                paths.append(os.path.join(dirpath, basename))
+    return paths
+
+
+def functions(config):
+    """
+    Returns a boundary set's functions, with represent-boundaries' defaults.
+    """
+    results = {}
+    for key, default in function_defaults:
+        results[key] = config.get(key) or default or results.get('name_func')
+    return results
+
+
+class TracingFeature(object):
+    """
+    Wraps a feature, recording the names of the fields that are read.
+    """
+    __slots__ = ('feature', 'names')
+
+    def __init__(self, feature, names):
+        """
+        `names` is the set to which lowercase field names are added.
+        """
+        self.feature = feature
+        self.names = names
+
+    def get(self, name):
+        self.names.add(name.lower())
+        return self.feature.get(name)
+
+
+def valid_features(config, names=None, paths=None, traced=None, indices=None):
+    """
+    Yields the path of each data source and each of its features that the
+    boundary set's `is_valid_func` accepts. Only the named fields are read, or
+    all fields if `names` is None. If `traced` is a set, the features are
+    `TracingFeature`s that add the fields read to it.
+
+    If `indices` maps each data source's path to the indices of the features
+    that the `is_valid_func` accepts, like a `Partition`, only those features
+    are read.
+    """
+    is_valid = functions(config)['is_valid_func']
+    for path in data_sources(dirname(config['file'])) if paths is None else paths:
+        if indices is None:
+            features = scan_dbf(path, names, encoding=config.get('encoding'))
+        else:
+            features = scan_dbf(path, names, encoding=config.get('encoding'), indices=indices.get(path, ()))
+        for feature in features:
+            if traced is not None:
+                feature = TracingFeature(feature, traced)
+            if indices is not None or is_valid(feature):
+                yield path, feature
+
+
+def check_features(slug, config, names=None, indices=None):
+    """
+    Returns the problems with the names and identifiers of a boundary set's
+    features, evaluating its functions on the shapefiles' attributes only, and
+    the names of the fields that its functions read, or None if they raised.
+
+    If `names` is set, only those fields are read. If a function reads another
+    field, the features are evaluated again with all fields. If `indices` is
+    set, only those features are read (see `valid_features`).
+    """
+    callables = functions(config)
+    traced = set() if names is None else None
+    messages = []
+    count = 0
+    empty = 0
+    # Features with the same slug are merged into one boundary, which may repeat an id.
+    slugs = defaultdict(set)
+    try:
+        for path, feature in valid_features(config, names, traced=traced, indices=indices):
+            count += 1
+            if not callables['name_func'](feature):
+                empty += 1
+            identifier = callables['id_func'](feature)
+            boundary = callables['slug_func'](feature)
+            if identifier not in (None, ''):
+                slugs[str(identifier)].add(str(boundary))
+    except Exception as e:
+        if isinstance(e, FieldNotRead) and names is not None:
+            return check_features(slug, config, indices=indices)
+        return ['%s: %s' % (e.__class__.__name__, e)], None
+
+    if not count:
+        messages.append('No features')
+    if empty:
+        messages.append('Empty name for %d features' % empty)
+    duplicates = ['%s (%d)' % (identifier, len(values)) for identifier, values in sorted(slugs.items()) if len(values) > 1]
+    if duplicates:
+        messages.append('Duplicate ids: %s' % ', '.join(duplicates))
+    return messages, sorted(traced) if traced is not None else names
+
+
+def fields_key(slug, config, definition_path, digests):
+    """
+    Returns a key for the inputs to a boundary set's functions: its definition
+    file and its data sources.
+    """
+    inputs = [slug, definition_path and cached_digest(definition_path, digests)]
+    for path in data_sources(dirname(config['file'])):
+        inputs.append((path, cached_digest(path, digests)))
+    return cache_key(*inputs)
+
+
+def evaluate_features(index, state_path=None, partitions=None):
+    """
+    Yields the slug of each boundary set in a `RegistryIndex` that has a
+    `name_func` and data sources, the problems with its features, and the names
+    of the fields that its functions read, or None if they raised.
+
+    `partitions` maps shared shapefiles to their `Partition`s, from which the
+    features of the boundary sets loaded from them are read.
+
+    If `state_path` is set, the fields that each boundary set's functions read
+    are stored in that file, and only those fields are read until its definition
+    file or data sources change. The fields are recorded from every feature,
+    not a sample, so that fields read only by some features are included.
+    """
+    state = load(state_path, {}) if state_path else {}
+    digests = state.get('digests', {})
+    sets = state.get('sets', {})
+
+    try:
+        for slug, config in index.items():
+            if 'name_func' not in config or not data_sources(dirname(config['file'])):
+                continue
+            names = None
+            if state_path:
+                key = fields_key(slug, config, index.paths.get(slug), digests)
+                if slug in sets and sets[slug][0] == key:
+                    names = sets[slug][1]
+            partition = partitions.get(config['file']) if partitions else None
+            if partition is None:
+                messages, fields = check_features(slug, config, names)
+            elif slug in partition.errors:
+                messages, fields = [partition.errors[slug]], None
+            else:
+                messages, fields = check_features(slug, config, names, partition.indices[slug])
+                if fields is not None:
+                    fields = sorted(set(fields).union(partition.fields))
+            if state_path and fields is not None:
+                sets[slug] = (key, fields)
+            yield slug, messages, fields
+    finally:
+        if state_path:
+            dump(state_path, {'digests': digests, 'sets': sets})
@@ -0,0 +1,176 @@
+# coding: utf-8
+import atexit
+import os
+import os.path
+import re
+from copy import deepcopy
+
+from cache import cache_key, cache_path, digest, dump, load
+from constants import authorities, quartiers
+from divisions import division_index
+
+province_or_territory_abbreviation_memo = {}
+divisions_with_boroughs_memo = set()
+get_definition_memo = {}
+memos = {'path': None, 'changed': False}
+ocd_division_csv = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'country-ca.csv')
+
+
+def read_memos():
+    """
+    Reads the memos persisted by other processes. The memos are invalidated if
+    country-ca.csv, constants.py or this file changes.
+    """
+    if memos['path'] is None:
+        key = cache_key(division_index(ocd_division_csv).sha1.hex(), digest(os.path.join(os.path.dirname(ocd_division_csv), 'constants.py')), digest(__file__))
+        memos['path'] = cache_path('memos', '%s.pickle' % key)
+        data = load(memos['path'], {})
+        province_or_territory_abbreviation_memo.update(data.get('province_or_territory_abbreviation', {}))
+        divisions_with_boroughs_memo.update(data.get('divisions_with_boroughs', set()))
+        get_definition_memo.update(data.get('get_definition', {}))
+        atexit.register(write_memos)
+
+
+def write_memos():
+    """
+    Persists the memos, if changed.
+    """
+    if memos['changed']:
+        dump(memos['path'], {
+            'province_or_territory_abbreviation': province_or_territory_abbreviation_memo,
+            'divisions_with_boroughs': divisions_with_boroughs_memo,
+            'get_definition': get_definition_memo,
+        })
+        memos['changed'] = False
+
+
+def province_or_territory_abbreviation(code):
+    read_memos()
+    if not province_or_territory_abbreviation_memo:
+        for division in division_index(ocd_division_csv).all('province', 'territory'):
+            province_or_territory_abbreviation_memo[division.attrs['sgc']] = type_id(division.id).upper()
+        memos['changed'] = True
+    return province_or_territory_abbreviation_memo[type_id(code)[:2]]
+
+
+def divisions_with_boroughs():
+    """
+    Returns the OCD identifiers for divisions with boroughs.
+    """
+    read_memos()
+    if not divisions_with_boroughs_memo:
+        for division in division_index(ocd_division_csv).all('borough'):
+            divisions_with_boroughs_memo.add(division.parent.id)
+        memos['changed'] = True
+    return divisions_with_boroughs_memo
+
+
+def type_id(id):
+    """
+    Returns an OCD identifier's type ID.
+    """
+    return id.rsplit(':', 1)[1]
+
+
+def get_definition(division_id, path=None, quiet=False):
+    """
+    Returns the expected contents of a definition file. Unless `quiet`, warns if
+    the division has no name.
+    """
+    read_memos()
+    key = (division_id, path)
+    if key not in get_definition_memo:
+        get_definition_memo[key] = expected_definition(division_id, path)
+        memos['changed'] = True
+    slug, config, named = get_definition_memo[key]
+    if not named and not quiet:
+        print('%-60s unknown name: check slug and domain manually' % division_id)
+    return deepcopy((slug, config))
+
+
+def memoize_definitions(entries):
+    """
+    Adds expected definitions that were determined by another process to the memo.
+    """
+    read_memos()
+    for key, value in entries.items():
+        if key not in get_definition_memo:
+            get_definition_memo[key] = value
+            memos['changed'] = True
+
+
+def expected_definition(division_id, path=None):
+    """
+    Determines the expected contents of a definition file, and whether the
+    division has a name.
+    """
+    config = {}
+
+    division = division_index(ocd_division_csv).get(division_id)
+
+    # Determine slug, domain and authority.
+    name = division.name
+
+    if division._type == 'country':
+        slug = 'Federal electoral districts'
+        config['domain'] = name
+        config['authority'] = ['Her Majesty the Queen in Right of Canada']
+
+    elif division._type in ('province', 'territory'):
+        slug = '%s electoral districts' % name
+        config['domain'] = name
+        config['authority'] = ['Her Majesty the Queen in Right of %s' % name]
+
+    elif division._type in ('cd', 'csd'):
+        province_or_territory_sgc_code = type_id(division.id)[:2]
+
+        if province_or_territory_sgc_code == '24' and division.id in divisions_with_boroughs():
+            slug = re.compile(r'\A%s (boroughs|districts)\Z' % name)
+        elif province_or_territory_sgc_code == '12' and division.attrs['classification'] != 'T':
+            slug = '%s districts' % name
+        elif province_or_territory_sgc_code == '47' and division.attrs['classification'] != 'CY':
+            slug = '%s divisions' % name
+        elif province_or_territory_sgc_code == '48' and division.attrs['classification'] == 'MD':
+            slug = '%s divisions' % name
+        elif province_or_territory_sgc_code == '24':
+            if division.id in quartiers:
+                slug = '%s quartiers' % name
+            else:
+                slug = '%s districts' % name
+        else:
+            slug = '%s wards' % name
+
+        config['domain'] = '%s, %s' % (name, province_or_territory_abbreviation(division.id))
+
+        if province_or_territory_sgc_code == '12' and 'boundaries/ca_ns_districts/' in path:
+            config['authority'] = ['Her Majesty the Queen in Right of Nova Scotia']
+        elif province_or_territory_sgc_code == '13' and 'boundaries/ca_nb_wards/' in path:
+            config['authority'] = ['Her Majesty the Queen in Right of New Brunswick']
+        elif province_or_territory_sgc_code == '24' and 'boundaries/ca_qc_' in path:
+            config['authority'] = ['Directeur général des élections du Québec']
+        elif province_or_territory_sgc_code == '47' and division.attrs['classification'] != 'CY':
+            config['authority'] = ['MuniSoft']
+        elif division._type == 'csd':
+            config['authority'] = authorities + [division.attrs['organization_name']]
+        else:
+            config['authority'] = ['']  # We have no expectation for the authority of a Census division
+
+    elif division._type == 'borough':
+        province_or_territory_sgc_code = type_id(division.parent.id)[:2]
+
+        if name:
+            slug = '%s districts' % name
+            config['domain'] = '%s, %s, %s' % (name, division.parent.name, province_or_territory_abbreviation(division.parent.id))
+        else:
+            slug = None
+            config['domain'] = None
+
+        if province_or_territory_sgc_code == '24':
+            config['authority'] = ['Directeur général des élections du Québec']
+        else:
+            config['authority'] = [division.parent.attrs['organization_name']]
+
+    else:
+        raise Exception('%s: Unrecognized OCD type %s' % (division.id, division._type))
+
+    return (slug, config, bool(name))
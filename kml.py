@@ -0,0 +1,170 @@
+# coding: utf-8
+import os.path
+import re
+
+from lxml import etree
+
+from esri import PolygonWriter, orient
+
+"""
+The elements whose placemarks form a layer.
+"""
+containers = ('Document', 'Folder')
+
+
+def localname(element):
+    return element.tag.rsplit('}', 1)[-1]
+
+
+def layer_basename(name):
+    """
+    Returns a filename-safe basename for a layer name.
+    """
+    return re.sub(r'[^\w #.()-]', '_', name).strip(' .') or 'Layer'
+
+
+def parse_coordinates(text):
+    """
+    Returns the 2D points in a KML coordinates element, discarding altitudes.
+    """
+    points = []
+    # Tuples are separated by whitespace, though some files add spaces after commas.
+    for value in re.split(r'\s+', re.sub(r',\s+', ',', (text or '').strip())):
+        if value:
+            coordinates = value.split(',')
+            points.append((float(coordinates[0]), float(coordinates[1])))
+    return points
+
+
+def ring(element):
+    """
+    Returns the points of the first LinearRing in an element, or None.
+    """
+    for child in element.iter():
+        if isinstance(child.tag, str) and localname(child) == 'coordinates':
+            points = parse_coordinates(child.text)
+            # A ring has at least three distinct points.
+            if len(points) >= 3:
+                return points
+            return None
+    return None
+
+
+def polygon_rings(placemark):
+    """
+    Returns the rings of a placemark's polygons as a single 2D polygon: each
+    outer ring clockwise, followed by its inner rings counter-clockwise. Points
+    and lines are ignored.
+    """
+    rings = []
+    for element in placemark.iter():
+        if not isinstance(element.tag, str) or localname(element) != 'Polygon':
+            continue
+        outer = None
+        inner = []
+        for child in element:
+            if not isinstance(child.tag, str):
+                continue
+            name = localname(child)
+            if name == 'outerBoundaryIs':
+                outer = ring(child)
+            elif name == 'innerBoundaryIs':
+                # Though KML allows only one LinearRing per innerBoundaryIs, many files have more.
+                for linear_ring in child:
+                    if isinstance(linear_ring.tag, str):
+                        points = ring(linear_ring)
+                        if points:
+                            inner.append(points)
+        if outer:
+            rings.append(orient(outer, True))
+            rings.extend(orient(points, False) for points in inner)
+    return rings
+
+
+def attributes(placemark):
+    """
+    Returns a placemark's name, description and extended data, like the KML
+    driver of ogr2ogr.
+    """
+    values = {'Name': None, 'Description': None}
+    for child in placemark:
+        if not isinstance(child.tag, str):
+            continue
+        name = localname(child)
+        if name == 'name':
+            values['Name'] = (child.text or '').strip()
+        elif name == 'description':
+            values['Description'] = (child.text or '').strip()
+        elif name == 'ExtendedData':
+            for data in child.iter():
+                if not isinstance(data.tag, str):
+                    continue
+                if localname(data) == 'Data' and data.get('name'):
+                    for value in data:
+                        if isinstance(value.tag, str) and localname(value) == 'value':
+                            values[data.get('name')] = (value.text or '').strip()
+                elif localname(data) == 'SimpleData' and data.get('name'):
+                    values[data.get('name')] = (data.text or '').strip()
+    return values
+
+
+def kml_to_shapefiles(path, directory, encoding='utf-8', basename=None):
+    """
+    Converts each layer of polygons in a KML file to a 2D polygon shapefile named
+    after the layer, and returns the paths of the files written. A layer is the
+    placemarks of a folder, or of the document outside any folder. Layers without
+    polygons are skipped. If `basename` is set, only the layer with that basename
+    is converted.
+
+    The file is streamed, so that only one placemark is in memory at a time.
+    """
+    writers = []
+    basenames = set()
+    # Each open container's element, name and writer.
+    stack = []
+
+    def layer_writer(layer):
+        if layer[2] is None:
+            name = layer_basename(layer[1] or 'Layer #%d' % len(writers))
+            unique = name
+            i = 1
+            while unique.lower() in basenames:
+                unique = '%s_%d' % (name, i)
+                i += 1
+            basenames.add(unique.lower())
+            if basename is not None and unique != basename:
+                layer[2] = False
+            else:
+                layer[2] = PolygonWriter(os.path.join(directory, unique), encoding=encoding)
+                writers.append(layer[2])
+        return layer[2]
+
+    try:
+        for event, element in etree.iterparse(path, events=('start', 'end'), huge_tree=True):
+            if not isinstance(element.tag, str):
+                continue
+            name = localname(element)
+            if event == 'start':
+                if name in containers:
+                    stack.append([element, None, None])
+            elif name in containers:
+                stack.pop()
+            elif name == 'name' and stack and element.getparent() is stack[-1][0]:
+                stack[-1][1] = (element.text or '').strip()
+            elif name == 'Placemark':
+                rings = polygon_rings(element)
+                if rings:
+                    if not stack:
+                        stack.append([None, None, None])
+                    writer = layer_writer(stack[-1])
+                    if writer:
+                        writer.write(rings, attributes(element))
+                # Free the memory used by the placemark and its preceding siblings.
+                element.clear()
+                while element.getprevious() is not None:
+                    del element.getparent()[0]
+    finally:
+        for writer in writers:
+            writer.close()
+
+    return [path for writer in writers for path in writer.paths()]
@@ -0,0 +1,61 @@
+# coding: utf-8
+import hashlib
+from collections import namedtuple
+
+from constants import all_rights_reserved_terms_re, terms, terms_re
+
+"""
+What a LICENSE.txt text matches: the License URLs whose exact template it
+matches, the License URLs whose pattern it matches, and, if it matches the
+"all rights reserved" template, the contact for licensing inquiries.
+"""
+LicenseMatch = namedtuple('LicenseMatch', ['sha1', 'exact', 'patterns', 'all_rights_reserved', 'contact'])
+
+
+class LicenseIndex(object):
+    """
+    Matches each distinct LICENSE.txt text against the templates once.
+    """
+    def __init__(self):
+        # The exact templates are looked up by the hash of their text.
+        self.templates = {}
+        for licence_url, template in terms.items():
+            self.templates.setdefault(fingerprint(template % licence_url), []).append(licence_url)
+        self.matches = {}
+        self.files = {}
+
+    def match(self, text):
+        """
+        Returns what a LICENSE.txt text matches.
+        """
+        sha1 = fingerprint(text)
+        if sha1 not in self.matches:
+            match = all_rights_reserved_terms_re.search(text)
+            self.matches[sha1] = LicenseMatch(
+                sha1,
+                frozenset(self.templates.get(sha1, ())),
+                frozenset(licence_url for licence_url, pattern in terms_re.items() if pattern.search(text)),
+                bool(match),
+                match.group(1) if match else None,
+            )
+        return self.matches[sha1]
+
+    def match_file(self, path):
+        """
+        Returns what a LICENSE.txt file matches.
+        """
+        if path not in self.files:
+            with open(path) as f:
+                self.files[path] = self.match(f.read().rstrip('\n'))
+        return self.files[path]
+
+    def licence_urls(self, path):
+        """
+        Returns the License URLs to which a LICENSE.txt file corresponds.
+        """
+        match = self.match_file(path)
+        return sorted(match.exact | match.patterns)
+
+
+def fingerprint(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
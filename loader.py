@@ -0,0 +1,279 @@
+# coding: utf-8
+import os
+import os.path
+from collections import OrderedDict
+from collections.abc import Mapping
+from fnmatch import fnmatchcase
+
+import boundaries
+
+from cache import cache_key, cache_path, digest, dump, load
+
+"""
+Increment to discard existing snapshots if their format changes.
+"""
+snapshot_version = 2
+
+"""
+The registry entries of definition files executed by this process, by path.
+"""
+executed = {}
+
+
+class Function(object):
+    """
+    Stands in for a callable in a registry snapshot. The definition file is
+    executed the first time the callable is called.
+    """
+    __slots__ = ('path', 'slug', 'key')
+
+    def __init__(self, path, slug, key):
+        self.path = path
+        self.slug = slug
+        self.key = key
+
+    def __getstate__(self):
+        return (self.path, self.slug, self.key)
+
+    def __setstate__(self, state):
+        self.path, self.slug, self.key = state
+
+    def __call__(self, *args, **kwargs):
+        return self.resolve()(*args, **kwargs)
+
+    def __eq__(self, other):
+        return isinstance(other, Function) and self.__getstate__() == other.__getstate__()
+
+    def __hash__(self):
+        return hash(self.__getstate__())
+
+    def __repr__(self):
+        return '<Function %s of %s in %s>' % (self.key, self.slug, self.path)
+
+    def resolve(self):
+        """
+        Returns the real callable.
+        """
+        if self.path not in executed:
+            execute(self.path)
+        return executed[self.path][self.slug][self.key]
+
+
+class RegistryIndex(Mapping):
+    """
+    A read-only mapping of slugs to boundary set configurations, indexed by the
+    values of some fields.
+    """
+    fields = ('division_id', 'domain', 'authority', 'source_url', 'licence_url', 'data_url', 'directory', 'file')
+
+    def __init__(self, registry, paths=None):
+        self.registry = registry
+        # The path to the definition file of each boundary set.
+        self.paths = paths or {}
+        self.indexes = {field: OrderedDict() for field in self.fields}
+        for slug, config in registry.items():
+            for field in self.fields:
+                value = field_value(config, field)
+                if value is not None:
+                    self.indexes[field].setdefault(value, []).append(slug)
+
+    def __getitem__(self, slug):
+        return self.registry[slug]
+
+    def __iter__(self):
+        return iter(self.registry)
+
+    def __len__(self):
+        return len(self.registry)
+
+    def lookup(self, field, value):
+        """
+        Returns the slugs of the boundary sets with the value for the field.
+        """
+        return self.indexes[field].get(value, [])
+
+    def groups(self, field):
+        """
+        Returns the values for the field, and the slugs of the boundary sets with each value.
+        """
+        return self.indexes[field].items()
+
+    def shared_shapefiles(self):
+        """
+        Returns the shapefiles from which multiple boundary sets are loaded, and
+        the slugs of those boundary sets.
+        """
+        return OrderedDict((key, slugs) for key, slugs in self.indexes['file'].items() if len(slugs) > 1)
+
+
+def dirname(path):
+    """
+    Returns the directory in which a shapefile exists.
+    """
+    # GitPython can't handle paths starting with "./".
+    if path.startswith('./'):
+        path = path[2:]
+    if os.path.isdir(path):
+        return path
+    else:
+        return os.path.dirname(path)
+
+
+def field_value(config, field):
+    """
+    Returns a boundary set's value for an indexed field.
+    """
+    if field == 'division_id':
+        return config.get('extra') and config['extra'].get('division_id') or None
+    if field == 'directory':
+        return dirname(config['file'])
+    return config.get(field)
+
+
+def division_prefix(dirpath):
+    """
+    Returns the OCD identifier of a directory in the OCD-ID tree, ignoring any
+    redistribution year, or None if the directory is outside the tree.
+    """
+    parts = os.path.normpath(dirpath).split(os.sep)
+    if 'ocd-division' not in parts:
+        return None
+    return '/'.join(part for part in parts[parts.index('ocd-division'):] if part == 'ocd-division' or ':' in part)
+
+
+def within(path, directory):
+    """
+    Returns whether a path is the directory or is in the directory.
+    """
+    return path == directory or path.startswith(directory.rstrip(os.sep) + os.sep)
+
+
+def definition_paths(base, division=None, path=None):
+    """
+    Yields the paths to definition files, in the same order as `boundaries.autodiscover`.
+
+    Skips directories outside `path` and, in the OCD-ID tree, directories that
+    can't contain boundary sets whose division ID starts with `division`.
+    """
+    target = path and os.path.abspath(path)
+    for (dirpath, dirnames, filenames) in os.walk(base, followlinks=True):
+        if '.git' in dirnames:
+            dirnames.remove('.git')
+
+        if target:
+            dirnames[:] = [name for name in dirnames if within(os.path.abspath(os.path.join(dirpath, name)), target) or within(target, os.path.abspath(os.path.join(dirpath, name)))]
+            if not within(os.path.abspath(dirpath), target):
+                continue
+
+        if division:
+            kept = []
+            for name in dirnames:
+                prefix = division_prefix(os.path.join(dirpath, name))
+                if prefix is None or prefix.startswith(division) or division.startswith(prefix):
+                    kept.append(name)
+            dirnames[:] = kept
+            prefix = division_prefix(dirpath)
+            if prefix is not None and not prefix.startswith(division):
+                continue
+
+        for filename in filenames:
+            if boundaries.definition_file_re.search(filename):
+                yield os.path.join(dirpath, filename)
+
+
+def selected(slug, config, division=None, pattern=None):
+    """
+    Returns whether a registry entry matches the division ID prefix and slug pattern.
+    """
+    if division:
+        division_id = field_value(config, 'division_id')
+        if not division_id or not division_id.startswith(division):
+            return False
+    if pattern and not fnmatchcase(slug, pattern):
+        return False
+    return True
+
+
+def execute(path):
+    """
+    Executes a definition file, and returns its registry entries in order.
+    """
+    registry = boundaries.registry
+    boundaries.registry = {}
+    boundaries._basepath = os.path.dirname(path)
+    try:
+        boundaries.import_file(path)
+        entries = list(boundaries.registry.items())
+    finally:
+        boundaries.registry = registry
+    executed[path] = dict(entries)
+    return entries
+
+
+def freeze(path, entries):
+    """
+    Replaces callables with picklable stand-ins.
+    """
+    frozen = []
+    for slug, config in entries:
+        config = config.copy()
+        # Preserve identity, so that the check for non-unique values still works.
+        functions = {}
+        for key, value in config.items():
+            if callable(value):
+                if id(value) not in functions:
+                    functions[id(value)] = value if isinstance(value, Function) else Function(path, slug, key)
+                config[key] = functions[id(value)]
+        frozen.append((slug, config))
+    return frozen
+
+
+def load_registry(base='.', division=None, slug=None, path=None, cache=True):
+    """
+    Reads definition files, executing only those that changed since the last
+    snapshot of the same base directory. Returns a `RegistryIndex`.
+
+    If `division` is set, returns only boundary sets whose division ID starts
+    with it. If `slug` is set, returns only boundary sets whose slug matches the
+    glob pattern. If `path` is set, reads only definition files in that directory.
+    Definition files that are excluded by their directory are never read; others
+    are executed only if missing from the snapshot.
+    """
+    snapshot_path = cache_path('registry', '%s.pickle' % cache_key(os.path.realpath(base)))
+
+    files = {}
+    if cache:
+        snapshot = load(snapshot_path, {})
+        if snapshot.get('version') == snapshot_version:
+            files = snapshot['files']
+
+    filtered = division or slug or path
+    if filtered:
+        # Keep the snapshots of unread files that still exist.
+        updated = {key: value for key, value in files.items() if os.path.exists(key)}
+    else:
+        updated = {}
+
+    registry = {}
+    paths = {}
+    changed = False
+    for definition_path in definition_paths(base, division=division, path=path):
+        sha1 = digest(definition_path)
+        if definition_path in files and files[definition_path][0] == sha1:
+            entries = files[definition_path][1]
+        else:
+            entries = execute(definition_path)
+            changed = True
+        updated[definition_path] = (sha1, freeze(definition_path, entries))
+        for key, config in entries:
+            if filtered and not selected(key, config, division=division, pattern=slug):
+                continue
+            if key in registry:
+                boundaries.log.warning('Multiple definitions of %s found.' % key)
+            registry[key] = config
+            paths[key] = definition_path
+
+    if changed or updated.keys() != files.keys():
+        dump(snapshot_path, {'version': snapshot_version, 'files': updated})
+
+    return RegistryIndex(registry, paths)
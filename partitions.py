@@ -0,0 +1,166 @@
+# coding: utf-8
+import os
+import os.path
+import shutil
+import struct
+from collections import OrderedDict, namedtuple
+
+import numpy
+
+from cache import cache_key, cache_path, cached_digest, dump, load
+from esri import FILE_HEADER, HEADER_SIZE, NULL, RECORD_HEADER, SHAPE_HEADER, union
+from evaluation import TracingFeature, data_sources, functions
+from loader import dirname
+from shapes import Shapefile, point_types, scan_dbf
+
+"""
+Increment to discard existing partition indexes if their format changes.
+"""
+partition_version = 1
+
+"""
+The type of the arrays of record indices.
+"""
+index_dtype = numpy.dtype('<u4')
+
+"""
+The features of a shared shapefile that each boundary set's `is_valid_func`
+accepts. `indices` maps each slug to a mapping of each data source's path to
+an array of record indices. `errors` maps the slugs of boundary sets whose
+`is_valid_func` raised to the exception's message. `fields` are the names of the
+fields that the `is_valid_func`s read.
+"""
+Partition = namedtuple('Partition', ['indices', 'errors', 'fields'])
+
+
+def partition_key(file, slugs, index, digests):
+    """
+    Returns a key for the inputs to a shared shapefile's partition: the boundary
+    sets' definition files and the data sources.
+    """
+    inputs = [file]
+    for slug in slugs:
+        path = index.paths.get(slug)
+        inputs.append((slug, path and cached_digest(path, digests)))
+    for path in data_sources(dirname(file)):
+        inputs.append((path, cached_digest(path, digests)))
+    return cache_key(*inputs)
+
+
+def build_partition(configs, paths):
+    """
+    Reads each data source once, evaluating the `is_valid_func` of every boundary
+    set on each feature, and returns a `Partition`. `configs` are pairs of slugs
+    and configurations.
+    """
+    indices = OrderedDict((slug, {}) for slug, config in configs)
+    errors = {}
+    traced = set()
+
+    # Boundary sets may decode the shapefile differently.
+    encodings = OrderedDict()
+    for slug, config in configs:
+        encodings.setdefault(config.get('encoding'), []).append((slug, functions(config)['is_valid_func']))
+
+    for encoding, tests in encodings.items():
+        for path in paths:
+            selected = {slug: [] for slug, is_valid in tests}
+            for feature in scan_dbf(path, encoding=encoding):
+                proxy = TracingFeature(feature, traced)
+                for slug, is_valid in tests:
+                    if slug in errors:
+                        continue
+                    try:
+                        if is_valid(proxy):
+                            selected[slug].append(feature.index)
+                    except Exception as e:
+                        errors[slug] = '%s: %s' % (e.__class__.__name__, e)
+            for slug, values in selected.items():
+                indices[slug][path] = numpy.array(values, dtype=index_dtype)
+
+    for slug in errors:
+        del indices[slug]
+    return Partition(indices, errors, sorted(traced))
+
+
+def shared_partitions(index, files=None, cache=True):
+    """
+    Returns a `Partition` for each shapefile in a `RegistryIndex` from which
+    multiple boundary sets are loaded, or for only the given shapefiles.
+
+    If `cache`, each partition is stored, and is rebuilt only if the boundary
+    sets' definition files or the data sources change.
+    """
+    partitions = OrderedDict()
+    for file, slugs in index.shared_shapefiles().items():
+        if files is not None and file not in files:
+            continue
+        paths = data_sources(dirname(file))
+        if not paths:
+            continue
+
+        if cache:
+            state_path = cache_path('partitions', '%s.pickle' % cache_key(os.path.realpath(file)))
+            state = load(state_path, {})
+            digests = state.get('digests', {})
+            key = partition_key(file, slugs, index, digests)
+            if state.get('version') == partition_version and state.get('key') == key:
+                partitions[file] = state['partition']
+                continue
+
+        partitions[file] = build_partition([(slug, index[slug]) for slug in slugs], paths)
+        if cache:
+            dump(state_path, {'version': partition_version, 'key': key, 'digests': digests, 'partition': partitions[file]})
+    return partitions
+
+
+def extract_shapefile(path, indices, output):
+    """
+    Writes the records of a shapefile at the given indices to a new shapefile,
+    copying each record byte for byte. `path` and `output` are paths to
+    shapefiles without their extensions.
+    """
+    with Shapefile(path) as source:
+        header = SHAPE_HEADER.unpack_from(source.shp, FILE_HEADER.size)
+        bbox = None
+        dbf = None
+        with open('%s.shp' % output, 'wb') as shp, open('%s.shx' % output, 'wb') as shx:
+            shp.write(b'\0' * HEADER_SIZE)
+            shx.write(b'\0' * HEADER_SIZE)
+            if source.dbf is not None:
+                dbf = open('%s.dbf' % output, 'wb')
+                # The header is copied with the new number of records.
+                dbf.write(source.dbf[:4] + struct.pack('<L', len(indices)) + source.dbf[8:source.dbf_header.header_length])
+
+            try:
+                for number, index in enumerate(indices, 1):
+                    index = int(index)
+                    content = source.content(index)
+                    shape_type = struct.unpack_from('<i', content)[0] if len(content) >= 4 else NULL
+                    if shape_type != NULL:
+                        if shape_type in point_types:
+                            x, y = struct.unpack_from('<2d', content, 4)
+                            record_bbox = (x, y, x, y)
+                        else:
+                            record_bbox = struct.unpack_from('<4d', content, 4)
+                        bbox = record_bbox if bbox is None else union(bbox, record_bbox)
+                    shx.write(RECORD_HEADER.pack(shp.tell() // 2, len(content) // 2))
+                    shp.write(RECORD_HEADER.pack(number, len(content) // 2))
+                    shp.write(content)
+                    if dbf:
+                        dbf.write(source.raw(index))
+                if dbf:
+                    dbf.write(b'\x1a')
+            finally:
+                if dbf:
+                    dbf.close()
+
+            # The Z and M ranges are the source's.
+            for f in (shp, shx):
+                length = f.tell()
+                f.seek(0)
+                f.write(FILE_HEADER.pack(9994, 0, 0, 0, 0, 0, length // 2) + SHAPE_HEADER.pack(1000, source.shape_type, *((bbox or (0, 0, 0, 0)) + header[6:])))
+
+    for extension in ('.prj', '.cpg'):
+        if os.path.exists(path + extension):
+            shutil.copyfile(path + extension, output + extension)
@@ -0,0 +1,151 @@
+# coding: utf-8
+import os
+import os.path
+import re
+from glob import escape, glob
+from zipfile import BadZipfile
+
+import requests
+from lxml import etree
+
+from archives import extract, extract_kml
+from esri import ShapefileError, flatten, merge_shapefiles, shape_types
+from kml import kml_to_shapefiles
+from projections import normalize_prj
+from loader import dirname
+
+
+def process(slug, config, url, data_file_path, last_updated):
+    """
+    Replaces a boundary set's shapefile with a downloaded data file, and updates
+    its `last_updated` date. Returns whether the date was updated.
+    """
+    # We can only process KML, KMZ and ZIP files.
+    extension = os.path.splitext(data_file_path)[1]
+    if extension in ('.kml', '.kmz', '.zip'):
+        directory = dirname(config['file'])
+
+        # Remove old files.
+        for basename in os.listdir(directory):
+            if basename not in ('.DS_Store', '__pycache__', 'definition.py', 'LICENSE.txt', 'data.kml', 'data.kmz', 'data.zip'):
+                os.unlink(os.path.join(directory, basename))
+
+        files_to_add = []
+
+        # Unzip any zip file.
+        error_thrown = False
+        size = 0
+        if extension == '.zip':
+            try:
+                paths, size = extract(data_file_path, directory, config, skip_crc32='skip_crc32' in config)
+                files_to_add.extend(paths)
+            except BadZipfile as e:
+                error_thrown = True
+                print('Bad ZIP file %s %s\n' % (e, url))
+            finally:
+                os.unlink(data_file_path)
+
+        # Unzip any KMZ file.
+        kmz_file_path = os.path.join(directory, 'data.kmz')
+        if not error_thrown and os.path.exists(kmz_file_path):
+            try:
+                with open(kmz_file_path, 'rb') as f:
+                    size += extract_kml(f, directory, skip_crc32='skip_crc32' in config)
+            except BadZipfile:
+                error_thrown = True
+                print('Bad KMZ file %s\n' % url)
+            finally:
+                os.unlink(kmz_file_path)
+
+        if size:
+            print('Extracted %.1f MB %s\n' % (size / 1048576, url))
+
+        if not error_thrown:
+            shp_file_path = glob(os.path.join(directory, '*.shp'))
+
+            # Convert any KML to shapefile.
+            if not shp_file_path:
+                kml_file_path = os.path.join(directory, 'data.kml')
+                if os.path.exists(kml_file_path):
+                    try:
+                        paths = kml_to_shapefiles(kml_file_path, directory, encoding=config.get('encoding', 'utf-8'), basename=config.get('basename'))
+                    except (etree.XMLSyntaxError, ValueError, IndexError) as e:
+                        print('Bad KML file %s %s\n' % (e, url))
+                        return False
+                    finally:
+                        os.unlink(kml_file_path)
+                    if not paths:
+                        print('No polygon layers %s\n' % url)
+                        return False
+                    files_to_add.extend(paths)
+                    shp_file_path = glob(os.path.join(directory, '*.shp'))
+
+            # Merge multiple shapefiles into one.
+            if len(shp_file_path) > 1:
+                basenames = [os.path.splitext(name)[0] for name in sorted(shp_file_path)]
+                merged_path = os.path.join(directory, 'Boundaries')
+                try:
+                    paths = merge_shapefiles(basenames, merged_path)
+                except ShapefileError as e:
+                    print('Can\'t merge shapefiles %s %s\n' % (e, url))
+                    return False
+                for basename in basenames:
+                    for name in glob('%s.[cdps][bhrp][fgjnpx]' % escape(basename)):
+                        if name in files_to_add:
+                            files_to_add.remove(name)
+                        if name not in paths:
+                            os.unlink(name)
+                files_to_add.extend(name for name in paths if name not in files_to_add)
+
+            shp_file_path = glob(os.path.join(directory, '*.shp'))
+            if shp_file_path:
+                shp_file_path = shp_file_path[0]
+            if shp_file_path and os.path.exists(shp_file_path):
+                basename = os.path.splitext(shp_file_path)[0]
+
+                # Convert any 3D or measured shapefile into 2D.
+                try:
+                    shape_type = flatten(basename)
+                except ShapefileError as e:
+                    print('Bad shapefile %s %s\n' % (e, url))
+                    return False
+                if shape_type:
+                    print('Converted %s to Polygon %s\n' % (shape_types[shape_type], shp_file_path))
+
+                # Replace projection names that GDAL doesn't recognize, like "Double_Stereographic".
+                prj_file_path = basename + '.prj'
+                if os.path.exists(prj_file_path):
+                    with open(prj_file_path) as f:
+                        prj = f.read()
+                    try:
+                        normalized, changes = normalize_prj(prj)
+                    except ValueError as e:
+                        print('Bad PRJ file %s %s\n' % (e, url))
+                        changes = []
+                    if changes:
+                        with open(prj_file_path, 'w') as f:
+                            f.write(normalized)
+                        print('%s %s\n' % ('\n'.join(changes), prj_file_path))
+                elif 'prj' in config:
+                    with open(prj_file_path, 'w') as f:
+                        f.write(requests.get(config['prj']).text)
+                    files_to_add.append(prj_file_path)
+                else:
+                    print('No PRJ file %s' % url)
+
+            # Update last updated timestamp.
+            definition_path = os.path.join(directory, 'definition.py')
+            with open(definition_path) as f:
+                definition = f.read()
+            with open(definition_path, 'w') as f:
+                f.write(re.sub(r'(?<=last_updated=date\()[\d, ]+', last_updated.strftime('%Y, %-m, %-d'), definition))
+
+            # Print notes.
+            if 'notes' in config:
+                print('%s\n%s\n' % (config['file'], config['notes']))
+
+            return True
+    else:
+        print('Unrecognized extension %s\n' % url)
+
+    return False
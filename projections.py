@@ -0,0 +1,112 @@
+# coding: utf-8
+import re
+
+"""
+Projection names that GDAL doesn't recognize in ESRI .prj files, and the
+names with which to replace them.
+"""
+projection_aliases = {
+    'Double_Stereographic': 'Oblique_Stereographic',
+}
+
+"""
+A WKT token: a quoted string, a keyword or number, a bracket or a comma.
+"""
+token_re = re.compile(r'\s*("[^"]*"|[A-Za-z_][A-Za-z0-9_]*|[-+]?[0-9.]+(?:[eE][-+]?[0-9]+)?|[\[\](),])')
+
+
+def tokenize(text):
+    tokens = []
+    position = 0
+    text = text.strip()
+    while position < len(text):
+        match = token_re.match(text, position)
+        if not match:
+            raise ValueError('Unexpected character at %d in %r' % (position, text))
+        tokens.append(match.group(1))
+        position = match.end()
+    return tokens
+
+
+def parse_node(tokens, index):
+    """
+    Parses the node starting at `index`, and returns the node and the index of
+    the next token.
+    """
+    keyword = tokens[index]
+    if not re.match(r'[A-Za-z_]', keyword) or index + 1 >= len(tokens) or tokens[index + 1] not in ('[', '('):
+        raise ValueError('Expected a keyword and bracket at %s' % keyword)
+    index += 2
+    values = []
+    while True:
+        if index >= len(tokens):
+            raise ValueError('Expected ] after %s' % keyword)
+        if index + 1 < len(tokens) and tokens[index + 1] in ('[', '('):
+            value, index = parse_node(tokens, index)
+        elif tokens[index] in ('[', ']', '(', ')', ','):
+            raise ValueError('Unexpected %s in %s' % (tokens[index], keyword))
+        else:
+            value = tokens[index]
+            index += 1
+        values.append(value)
+        if index >= len(tokens):
+            raise ValueError('Expected ] after %s' % keyword)
+        if tokens[index] in (']', ')'):
+            return [keyword, values], index + 1
+        if tokens[index] != ',':
+            raise ValueError('Expected , not %s in %s' % (tokens[index], keyword))
+        index += 1
+
+
+def parse_wkt(text):
+    """
+    Parses a WKT string into a list of nodes. A node is a list of a keyword and
+    its values, which are nodes, quoted strings (with their quotes) or numbers
+    (as strings). ESRI .prj files may have more than one node, like a PROJCS
+    followed by a VERTCS.
+    """
+    tokens = tokenize(text)
+    if not tokens:
+        raise ValueError('Empty WKT')
+    nodes = []
+    index = 0
+    while True:
+        node, index = parse_node(tokens, index)
+        nodes.append(node)
+        if index == len(tokens):
+            return nodes
+        if tokens[index] != ',' or index + 1 == len(tokens):
+            raise ValueError('Unexpected %s after %s' % (tokens[index], node[0]))
+        index += 1
+
+
+def dump_wkt(nodes):
+    """
+    Returns nodes as a WKT string, without whitespace, as in ESRI .prj files.
+    """
+    return ','.join('%s[%s]' % (node[0], dump_wkt(node[1])) if isinstance(node, list) else node for node in nodes)
+
+
+def normalize_prj(text):
+    """
+    Returns the contents of a .prj file with unrecognized projection names
+    replaced, and descriptions of the changes. Raises `ValueError` if the WKT
+    is invalid.
+    """
+    nodes = parse_wkt(text)
+    changes = []
+
+    def walk(node):
+        if node[0].upper() == 'PROJECTION' and node[1] and node[1][0].strip('"') in projection_aliases:
+            name = node[1][0].strip('"')
+            node[1][0] = '"%s"' % projection_aliases[name]
+            changes.append('Replaced projection %s with %s' % (name, projection_aliases[name]))
+        for value in node[1]:
+            if isinstance(value, list):
+                walk(value)
+
+    for node in nodes:
+        walk(node)
+    if changes:
+        return dump_wkt(nodes), changes
+    return text, changes
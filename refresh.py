@@ -0,0 +1,352 @@
+# coding: utf-8
+import ftplib
+import os.path
+import sys
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
+from multiprocessing import Pool
+from urllib.parse import urlparse
+
+import requests
+from rfc6266 import parse_headers
+
+from arcgis import ArcGISError, download_layer, is_layer_url, last_edit_date, layer_info, to_datetime
+from downloads import (
+    IncompleteDownload,
+    archive,
+    download_ftp,
+    download_http,
+    download_members,
+    load_state,
+    load_target,
+    mark_processed,
+    report,
+    save_state,
+    save_target,
+    url_lock,
+)
+from kml import layer_basename
+from loader import dirname
+from processing import process
+from remote import timeout
+from urlcheck import headers, host_lanes
+
+"""
+An out-of-date shapefile: the boundary set whose `data_url` it is, the URL from
+which it is downloaded, the date on which the source was last modified, the
+path to which it is downloaded, and its SHA-256 hex digest, once downloaded.
+"""
+Update = namedtuple('Update', ['slug', 'config', 'url', 'last_updated', 'data_file_path', 'sha256'])
+
+"""
+The errors that cause a shapefile to be skipped.
+"""
+errors = (requests.exceptions.RequestException, IncompleteDownload, ArcGISError) + ftplib.all_errors
+
+
+def ftp_connect(url):
+    """
+    Returns an FTP connection to the URL's host.
+    """
+    parsed = urlparse(url)
+    ftp = ftplib.FTP()
+    ftp.connect(parsed.hostname, parsed.port or 21, timeout=timeout[0])
+    ftp.sock.settimeout(timeout[1])
+    ftp.login(parsed.username, parsed.password)
+    return ftp
+
+
+def ftp_quit(ftp):
+    if ftp:
+        try:
+            ftp.quit()
+        except ftplib.all_errors:
+            ftp.close()
+
+
+def ftp_reset(ftp, e):
+    """
+    Returns the FTP connection, or None if it was closed due to an error.
+    """
+    if ftp and not isinstance(e, ftplib.error_perm):
+        ftp_quit(ftp)
+        return None
+    return ftp
+
+
+def changed(update, download, validator):
+    """
+    Returns the update with the hash of its download, if the download differs
+    from the archive last processed from its URL into the boundary set's
+    directory. Otherwise, deletes the download and records its Last-Modified or
+    MDTM value, so that it isn't downloaded again while that value is unchanged.
+    """
+    directory = dirname(update.config['file'])
+    state = load_target(update.url, directory)
+    state['etag'] = load_state(update.url).get('etag')
+    if download.sha256 == state.get('processed'):
+        os.unlink(download.path)
+        state['unchanged'] = validator
+        # Send the ETag, as the last updated date is unchanged.
+        state['last_updated'] = update.config['last_updated']
+        save_target(update.url, directory, state)
+        sys.stdout.write('%s are unchanged at the source %s\n\n' % (update.slug, update.url))
+        return None
+
+    archive(download)
+    # Send the ETag only once the last updated date is updated.
+    state['last_updated'] = update.last_updated
+    save_target(update.url, directory, state)
+    return update._replace(sha256=download.sha256)
+
+
+def update_ftp(ftp, slug, config, plan=False):
+    """
+    Returns an `Update` if the shapefile at an FTP URL is out-of-date, after
+    downloading it over the same connection, unless `plan`.
+    """
+    url = config['data_url']
+    path = urlparse(url).path
+
+    # Get the last modified timestamp.
+    last_modified = ftp.sendcmd('MDTM %s' % path)
+
+    # Parse the timestamp as a date.
+    last_updated = datetime.strptime(last_modified[4:], '%Y%m%d%H%M%S').date()
+
+    if config['last_updated'] < last_updated and last_modified != load_target(url, dirname(config['file'])).get('unchanged'):
+        # Determine the file extension.
+        extension = os.path.splitext(url)[1]
+
+        # Set the new file's name.
+        data_file_path = os.path.join(dirname(config['file']), 'data%s' % extension)
+
+        update = Update(slug, config, url, last_updated, data_file_path, None)
+
+        # Download new file.
+        if not plan:
+            download = download_ftp(ftp, url, path, data_file_path, modified=last_modified)
+            return changed(update, download, last_modified)
+
+        return update
+
+
+def update_http(session, slug, config, plan=False):
+    """
+    Returns an `Update` if the shapefile at an HTTP URL is out-of-date, after
+    downloading it, unless `plan`.
+
+    Sends a single conditional GET request, using the `last_updated` date and,
+    if the shapefile was last updated from this URL, its ETag.
+    """
+    url = config['data_url']
+    result = urlparse(url)
+
+    arguments = {}
+    if result.username:
+        url = '%s://%s%s' % (result.scheme, result.hostname, result.path)
+        arguments['auth'] = (result.username, result.password)
+
+    # The source is out-of-date if it was last modified after the last updated date.
+    conditions = {'If-Modified-Since': config['last_updated'].strftime('%a, %d %b %Y 23:59:59 GMT')}
+    state = load_target(url, dirname(config['file']))
+    if state.get('etag') and state.get('last_updated') == config['last_updated']:
+        conditions['If-None-Match'] = state['etag']
+
+    updates = []
+
+    def respond(response):
+        last_modified = response.headers.get('last-modified')
+
+        # Parse the timestamp as a date.
+        if last_modified:
+            last_updated = datetime.strptime(last_modified, '%a, %d %b %Y %H:%M:%S GMT')
+        else:
+            last_updated = datetime.now()
+        last_updated = last_updated.date()
+
+        if config['last_updated'] > last_updated:
+            # Messages are written in one call, as they are written from multiple threads.
+            sys.stdout.write('%s are more recent than the source (%s > %s)\n\n' % (slug, config['last_updated'], last_updated))
+        elif config['last_updated'] < last_updated and not (last_modified and last_modified == state.get('unchanged')):
+            # Determine the file extension.
+            if 'content-disposition' in response.headers:
+                filename = parse_headers(response.headers['content-disposition']).filename_unsafe
+            else:
+                filename = url
+
+            extension = os.path.splitext(filename)[1].lower()
+            if not extension:
+                if response.headers['content-type'] == 'application/vnd.google-earth.kml+xml; charset=utf-8':
+                    extension = '.kml'
+
+            # Set the new file's name.
+            data_file_path = os.path.join(dirname(config['file']), 'data%s' % extension)
+
+            updates.append((Update(slug, config, url, last_updated, data_file_path, None), last_modified))
+            if not plan:
+                # If only some members are extracted, download only those members.
+                if extension == '.zip' and 'basename' in config and response.status_code == 200 and response.headers.get('accept-ranges') == 'bytes' and response.headers.get('content-length') and not response.headers.get('content-encoding'):
+                    ranged.append((int(response.headers['content-length']), response.headers.get('etag')))
+                    return None
+                return data_file_path
+
+    # Download new file.
+    path = os.path.join(dirname(config['file']), 'data')
+    ranged = []
+    try:
+        download = download_http(session, url, path, headers=headers, conditions=conditions, respond=respond, **arguments)
+    except requests.exceptions.SSLError:
+        arguments['verify'] = False
+        download = download_http(session, url, path, headers=headers, conditions=conditions, respond=respond, **arguments)
+
+    if ranged:
+        update = updates[0][0]
+        size, etag = ranged[0]
+        download = download_members(session, url, update.data_file_path, size, config, headers=headers, **arguments)
+        if download:
+            with url_lock(url):
+                state = load_state(url)
+                state['etag'] = etag
+                save_state(url, state)
+        else:
+            download = download_http(session, url, path, headers=headers, respond=lambda response: update.data_file_path, **arguments)
+
+    if download:
+        return changed(updates[0][0], download, updates[0][1])
+    if updates:
+        return updates[0][0]
+
+
+def update_arcgis(session, slug, config, plan=False, jobs=2):
+    """
+    Returns an `Update` if the ArcGIS REST API layer at a URL was edited after
+    the last updated date, after downloading it as a zipped shapefile, unless
+    `plan`. Up to `jobs` pages of features are requested at a time.
+    """
+    url = config['data_url']
+
+    arguments = {}
+    try:
+        info = layer_info(session, url, **arguments)
+    except requests.exceptions.SSLError:
+        arguments['verify'] = False
+        info = layer_info(session, url, **arguments)
+
+    edited = last_edit_date(info)
+
+    # Parse the timestamp as a date.
+    if edited:
+        last_updated = to_datetime(edited).date()
+    else:
+        last_updated = datetime.now().date()
+
+    if config['last_updated'] > last_updated:
+        sys.stdout.write('%s are more recent than the source (%s > %s)\n\n' % (slug, config['last_updated'], last_updated))
+    elif config['last_updated'] < last_updated and not (edited and edited == load_target(url, dirname(config['file'])).get('unchanged')):
+        # Set the new file's name.
+        data_file_path = os.path.join(dirname(config['file']), 'data.zip')
+
+        update = Update(slug, config, url, last_updated, data_file_path, None)
+
+        # Download new file.
+        if not plan:
+            basename = config.get('basename') or layer_basename(info.get('name') or 'Boundaries')
+            download, _ = download_layer(session, url, data_file_path, basename, info, encoding=config.get('encoding', 'utf-8'), jobs=jobs, **arguments)
+            report(url, download)
+            return changed(update, download, edited)
+
+        return update
+
+
+def update_lane(sets, plan=False, per_host=2):
+    """
+    Returns the out-of-date shapefiles among boundary sets whose `data_url` are
+    on the same host, after downloading them, reusing one connection. Pages of
+    ArcGIS REST API layers are requested `per_host` at a time.
+    """
+    updates = []
+    session = requests.Session()
+    ftp = None
+    try:
+        for slug, config in sets:
+            url = config['data_url']
+            try:
+                if urlparse(url).scheme == 'ftp':
+                    if ftp is None:
+                        ftp = ftp_connect(url)
+                    update = update_ftp(ftp, slug, config, plan)
+                elif is_layer_url(url):
+                    update = update_arcgis(session, slug, config, plan, jobs=per_host)
+                else:
+                    update = update_http(session, slug, config, plan)
+            except errors as e:
+                sys.stdout.write('%s %s\n\n' % (e, url))
+                ftp = ftp_reset(ftp, e)
+                continue
+            if update:
+                updates.append(update)
+    finally:
+        session.close()
+        ftp_quit(ftp)
+    return updates
+
+
+def process_update(update):
+    if process(update.slug, update.config, update.url, update.data_file_path, update.last_updated):
+        mark_processed(update.url, dirname(update.config['file']), update.sha256)
+
+
+def stage(function, lanes, jobs):
+    """
+    Runs a function on each lane, `jobs` lanes at a time, and returns the
+    concatenated results.
+    """
+    results = []
+    with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+        for result in executor.map(function, lanes):
+            results.extend(result)
+    return results
+
+
+def download_updates(sets, jobs=4, per_host=2, plan=False):
+    """
+    Returns the out-of-date shapefiles among boundary sets, given as slugs and
+    picklable configurations, after downloading them, unless `plan`.
+    """
+    order = {slug: i for i, (slug, config) in enumerate(sets)}
+    lanes = host_lanes(sets, url=lambda item: item[1]['data_url'], per_host=per_host)
+    updates = stage(partial(update_lane, plan=plan, per_host=per_host), lanes, jobs)
+    return sorted(updates, key=lambda update: order[update.slug])
+
+
+def process_group(updates):
+    """
+    Processes the downloaded shapefiles of a directory, one at a time, as each
+    replaces the files in the directory.
+    """
+    for update in updates:
+        process_update(update)
+
+
+def process_all(updates, jobs=4):
+    """
+    Processes downloaded shapefiles, one directory per job.
+    """
+    groups = OrderedDict()
+    for update in updates:
+        groups.setdefault(dirname(update.config['file']), []).append(update)
+
+    if jobs == 1 or len(groups) < 2:
+        for group in groups.values():
+            process_group(group)
+    else:
+        pool = Pool(jobs or None)
+        try:
+            for _ in pool.imap_unordered(process_group, groups.values()):
+                pass
+        finally:
+            pool.close()
+            pool.join()
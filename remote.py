@@ -0,0 +1,88 @@
+# coding: utf-8
+import csv
+import os
+import os.path
+import sys
+import tempfile
+import time
+
+import requests
+
+from cache import cache_key, cache_path, dump, load
+
+"""
+The connect and read timeouts, in seconds.
+"""
+timeout = (10, 60)
+
+"""
+The number of bytes to read from a response at a time.
+"""
+chunk_size = 1 << 16
+
+
+def cached_get(url, max_age=3600, offline=False):
+    """
+    Returns the path to a cached copy of a remote document, downloading it only
+    if it changed since it was cached.
+
+    A cached copy younger than `max_age` seconds is used without revalidating it.
+    Otherwise, it is revalidated with its ETag and Last-Modified headers. If
+    `offline`, or if the request fails, any cached copy is used.
+    """
+    key = cache_key(url)
+    body_path = cache_path('http', '%s.body' % key)
+    meta_path = cache_path('http', '%s.meta' % key)
+    meta = load(meta_path) if os.path.exists(body_path) else None
+
+    if meta and (offline or time.time() - meta['fetched'] < max_age):
+        return body_path
+    if offline:
+        raise Exception('No cached copy of %s (run without --offline)' % url)
+
+    headers = {}
+    if meta:
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+
+    try:
+        response = requests.get(url, headers=headers, stream=True, timeout=timeout)
+        if response.status_code == 304 and meta:
+            response.close()
+        else:
+            response.raise_for_status()
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(body_path), prefix='.tmp-')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    for chunk in response.iter_content(chunk_size=chunk_size):
+                        f.write(chunk)
+                os.replace(temp_path, body_path)
+            except BaseException:
+                if os.path.exists(temp_path):
+                    os.unlink(temp_path)
+                raise
+            meta = {
+                'url': url,
+                'etag': response.headers.get('etag'),
+                'last_modified': response.headers.get('last-modified'),
+            }
+    except requests.exceptions.RequestException as e:
+        if not meta:
+            raise
+        sys.stderr.write('Using cached copy of %s (%s)\n' % (url, e))
+        return body_path
+
+    meta['fetched'] = time.time()
+    dump(meta_path, meta)
+    return body_path
+
+
+def csv_dict_reader(url, encoding='utf-8', max_age=3600, offline=False):
+    """
+    Reads a remote CSV file through the cache, one row at a time.
+    """
+    with open(cached_get(url, max_age=max_age, offline=offline), encoding=encoding, newline='') as f:
+        for row in csv.DictReader(f):
+            yield row
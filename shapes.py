@@ -0,0 +1,484 @@
+# coding: utf-8
+import codecs
+import mmap
+import os.path
+import re
+import struct
+from collections import OrderedDict, namedtuple
+from datetime import date
+
+import numpy
+
+from esri import (
+    DBF_FIELD,
+    DBF_HEADER,
+    FILE_HEADER,
+    HEADER_SIZE,
+    NULL,
+    RECORD_HEADER,
+    SHAPE_HEADER,
+    DBFHeader,
+    Field,
+    ShapefileError,
+)
+
+"""
+A record's geometry. `points` is an array of X and Y coordinates, `parts` is an
+array of the indices in `points` at which each ring or line starts, and `z` and
+`m` are arrays of Z and M values, or None. The arrays are views of the mapped
+file, valid until the shapefile is closed.
+"""
+Geometry = namedtuple('Geometry', ['shape_type', 'points', 'parts', 'z', 'm'])
+
+"""
+The shape types of points, multipoints, and lines and polygons, with their Z
+and M variants.
+"""
+point_types = (1, 11, 21)
+multipoint_types = (8, 18, 28)
+part_types = (3, 5, 13, 15, 23, 25, 31)
+
+"""
+The shape types with Z values, and with optional M values.
+"""
+z_types = (11, 13, 15, 18, 31)
+m_types = (11, 13, 15, 18, 21, 23, 25, 28, 31)
+
+"""
+Code pages in .cpg files that aren't Python codec names.
+"""
+code_pages = {
+    'ANSI': 'cp1252',
+    'OEM': 'cp437',
+}
+
+"""
+The encoding of a .dbf file without a .cpg file or an encoding from its
+definition.
+"""
+default_encoding = 'iso-8859-1'
+
+"""
+The NumPy types of coordinates and of ring offsets.
+"""
+coordinate_dtype = numpy.dtype('<f8')
+offset_dtype = numpy.dtype('<i4')
+
+
+def cpg_encoding(path):
+    """
+    Returns the Python codec name for the code page in a .cpg file, or None if
+    the file doesn't exist or the code page is unknown.
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        value = f.read().decode('ascii', 'replace').strip()
+    value = code_pages.get(value.upper(), value)
+    if value.isdigit():
+        # "88591" is ISO-8859-1, and "1252" is Windows-1252.
+        match = re.match(r'\A8859(\d+)\Z', value)
+        value = 'iso-8859-%s' % match.group(1) if match else 'cp%s' % value
+    try:
+        return codecs.lookup(value).name
+    except LookupError:
+        return None
+
+
+def map_file(path):
+    """
+    Returns a read-only memory map of a file, or an empty bytes object if the
+    file is empty, as empty files can't be mapped.
+    """
+    with open(path, 'rb') as f:
+        if not os.fstat(f.fileno()).st_size:
+            return b''
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def parse_dbf_header(data, path):
+    """
+    Returns the `DBFHeader` of a .dbf file's contents.
+    """
+    if len(data) < DBF_HEADER.size:
+        raise ShapefileError('Bad header in %s' % path)
+    header = DBF_HEADER.unpack_from(data)
+    fields = []
+    for offset in range(DBF_HEADER.size, header[5] - DBF_FIELD.size + 1, DBF_FIELD.size):
+        if data[offset:offset + 1] == b'\r':
+            break
+        name, type, length, decimals = DBF_FIELD.unpack_from(data, offset)
+        fields.append(Field(name.split(b'\0', 1)[0].decode('latin-1'), type.decode('latin-1'), length, decimals))
+    return DBFHeader(header[4], header[5], header[6], fields)
+
+
+def decode_value(raw, field, encoding):
+    """
+    Decodes a .dbf value, returning None if it is blank or invalid.
+    """
+    if field.type == 'C':
+        return bytes(raw).decode(encoding, 'replace').rstrip(' \0')
+    value = bytes(raw).strip(b' \0')
+    if not value or value.startswith(b'*'):
+        return None
+    if field.type in ('N', 'F'):
+        try:
+            if field.decimals or b'.' in value or b'e' in value.lower():
+                return float(value)
+            return int(value)
+        except ValueError:
+            return None
+    if field.type == 'D':
+        try:
+            return date(int(value[:4]), int(value[4:6]), int(value[6:8]))
+        except ValueError:
+            return None
+    if field.type == 'L':
+        if value in b'YyTt':
+            return True
+        if value in b'NnFf':
+            return False
+        return None
+    return bytes(raw).decode(encoding, 'replace').strip()
+
+
+def decode_column(values, field, encoding):
+    """
+    Decodes a batch of a .dbf field's values, given as bytes.
+    """
+    if field.type == 'C':
+        # Decode the batch at once. NumPy strips trailing null bytes, so null bytes separate values.
+        decoded = b'\0'.join(values).decode(encoding, 'replace').split('\0')
+        if len(decoded) == len(values):
+            return [value.rstrip(' ') for value in decoded]
+    elif field.type in ('N', 'F'):
+        # int() and float() ignore surrounding whitespace. Invalid values are decoded one at a time.
+        try:
+            if field.decimals:
+                return [float(value) if value.strip() else None for value in values]
+            return [int(value) if value.strip() else None for value in values]
+        except ValueError:
+            pass
+    return [decode_value(value, field, encoding) for value in values]
+
+
+def scan_dbf(path, names=None, encoding=None, batch_size=4096, indices=None):
+    """
+    Yields a `Feature` for each record of a .dbf file that isn't deleted, with
+    the values of only the named fields, or of all fields if `names` is None.
+    If `indices` is set, only the records at those indices are read.
+
+    Records are read in batches of `batch_size` through a NumPy view of the
+    mapped file whose fields are only the named fields, so that each batch of a
+    field's values is copied and decoded at once, and other fields are never
+    read. `encoding` defaults to the .cpg file's encoding, if any.
+    """
+    if encoding is None:
+        encoding = cpg_encoding('%s.cpg' % os.path.splitext(path)[0]) or default_encoding
+    data = map_file(path)
+    records = batch = None
+    try:
+        header = parse_dbf_header(data, path)
+        by_name = {field.name.lower(): field for field in header.fields}
+        if names is None:
+            names = [field.name for field in header.fields]
+        keys = [name.lower() for name in names]
+
+        offsets = {}
+        offset = 1
+        for field in header.fields:
+            offsets[field.name.lower()] = offset
+            offset += field.length
+
+        # A field that isn't in the file has no value.
+        columns = [key for key in OrderedDict.fromkeys(keys) if key in by_name]
+        dtype = numpy.dtype({
+            'names': ['deleted'] + ['f%d' % i for i in range(len(columns))],
+            'formats': ['S1'] + ['S%d' % by_name[key].length for key in columns],
+            'offsets': [0] + [offsets[key] for key in columns],
+            'itemsize': header.record_length,
+        })
+        count = min(header.count, max(len(data) - header.header_length, 0) // header.record_length)
+        records = numpy.frombuffer(data, dtype=dtype, count=count, offset=header.header_length)
+
+        if indices is not None:
+            indices = numpy.asarray(indices, dtype=numpy.int64)
+            indices = indices[indices < count]
+
+        missing = {key: None for key in keys if key not in by_name}
+        for start in range(0, count if indices is None else len(indices), batch_size):
+            if indices is None:
+                batch = records[start:start + batch_size]
+                positions = range(start, start + len(batch))
+            else:
+                positions = indices[start:start + batch_size]
+                # Copies only the selected records.
+                batch = records[positions]
+                positions = positions.tolist()
+            values = [decode_column(batch['f%d' % i].tolist(), by_name[key], encoding) for i, key in enumerate(columns)]
+            deleted = batch['deleted'].tolist()
+            for position, row in zip(positions, zip(deleted, *values)):
+                if row[0] != b'*':
+                    attributes = dict(zip(columns, row[1:]))
+                    attributes.update(missing)
+                    yield Feature(position, attributes)
+    finally:
+        # Release the views of the map, so that it can be closed.
+        records = batch = None
+        if isinstance(data, mmap.mmap):
+            try:
+                data.close()
+            except BufferError:
+                pass
+
+
+class FieldNotRead(KeyError):
+    """
+    Raised if a feature's field wasn't read.
+    """
+
+
+class Feature(object):
+    """
+    A record's values of some fields. Like the features passed to a boundary
+    set's `name_func`, its `get` method returns the value of a field.
+    """
+    __slots__ = ('index', 'attributes')
+
+    def __init__(self, index, attributes):
+        """
+        `index` is the record's index in the shapefile. `attributes` maps
+        lowercase field names to values.
+        """
+        self.index = index
+        self.attributes = attributes
+
+    def get(self, name):
+        """
+        Returns a field's value. Raises `FieldNotRead` if the field wasn't read.
+        """
+        try:
+            return self.attributes[name.lower()]
+        except KeyError:
+            raise FieldNotRead('%s was not read' % name)
+
+    def __repr__(self):
+        return '<Feature %d>' % self.index
+
+
+class Record(object):
+    """
+    A lazy shapefile record. Its geometry and attributes are read only when
+    accessed.
+    """
+    __slots__ = ('shapefile', 'index')
+
+    def __init__(self, shapefile, index):
+        self.shapefile = shapefile
+        self.index = index
+
+    @property
+    def geometry(self):
+        return self.shapefile.geometry(self.index)
+
+    def get(self, name, default=None):
+        """
+        Returns an attribute's value, like the features passed to `name_func`.
+        """
+        return self.shapefile.value(self.index, name, default)
+
+    def attributes(self):
+        return {field.name: self.shapefile.value(self.index, field.name) for field in self.shapefile.fields}
+
+    def __repr__(self):
+        return '<Record %d of %s>' % (self.index, self.shapefile.path)
+
+
+class Shapefile(object):
+    """
+    A memory-mapped shapefile. Records are read only when accessed, through
+    memoryviews of the mapped .shp and .dbf files, without reading whole files
+    into memory.
+    """
+
+    def __init__(self, path, encoding=None):
+        """
+        `path` is the path to the shapefile, with or without its extension.
+        `encoding` is the encoding of the .dbf file, like a definition's
+        `encoding`; if not set, the .cpg file's encoding is used, if any.
+        """
+        if path.lower().endswith('.shp'):
+            path = path[:-4]
+        self.path = path
+        self.maps = []
+
+        self.shp = self.map('%s.shp' % path)
+        if len(self.shp) < HEADER_SIZE or FILE_HEADER.unpack_from(self.shp)[0] != 9994:
+            raise ShapefileError('Bad header in %s.shp' % path)
+        header = SHAPE_HEADER.unpack_from(self.shp, FILE_HEADER.size)
+        self.shape_type = header[1]
+        self.bbox = header[2:6]
+
+        if os.path.exists('%s.shx' % path):
+            shx = self.map('%s.shx' % path)
+            index = numpy.frombuffer(shx, dtype='>i4', offset=HEADER_SIZE).reshape(-1, 2)
+            # Skip each record's header.
+            self.offsets = index[:, 0].astype(numpy.int64) * 2 + RECORD_HEADER.size
+            self.lengths = index[:, 1].astype(numpy.int64) * 2
+        else:
+            self.offsets, self.lengths = self.scan()
+
+        self.dbf = None
+        self.fields = []
+        self.record_length = 0
+        self.slices = {}
+        if os.path.exists('%s.dbf' % path):
+            self.dbf = self.map('%s.dbf' % path)
+            self.dbf_header = parse_dbf_header(self.dbf, '%s.dbf' % path)
+            self.fields = self.dbf_header.fields
+            self.record_length = self.dbf_header.record_length
+            offset = 1
+            for field in self.fields:
+                # Like OGR, field names are case-insensitive.
+                self.slices[field.name.lower()] = (offset, offset + field.length, field)
+                offset += field.length
+
+        self.encoding = encoding or cpg_encoding('%s.cpg' % path) or default_encoding
+
+    def map(self, path):
+        data = map_file(path)
+        self.maps.append(data)
+        return data
+
+    def scan(self):
+        """
+        Returns the offsets and lengths of the .shp file's records, if there's no
+        .shx file.
+        """
+        offsets = []
+        lengths = []
+        position = HEADER_SIZE
+        while position + RECORD_HEADER.size <= len(self.shp):
+            length = RECORD_HEADER.unpack_from(self.shp, position)[1] * 2
+            offsets.append(position + RECORD_HEADER.size)
+            lengths.append(length)
+            position += RECORD_HEADER.size + length
+        return numpy.array(offsets, dtype=numpy.int64), numpy.array(lengths, dtype=numpy.int64)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('Record index out of range')
+        return Record(self, index)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield Record(self, index)
+
+    def content(self, index):
+        """
+        Returns a memoryview of a record's content in the .shp file.
+        """
+        offset = int(self.offsets[index])
+        return memoryview(self.shp)[offset:offset + int(self.lengths[index])]
+
+    def geometry(self, index):
+        """
+        Returns a record's `Geometry`, or None if its shape is null.
+        """
+        content = self.content(index)
+        if len(content) < 4:
+            raise ShapefileError('Truncated record %d in %s.shp' % (index, self.path))
+        shape_type = struct.unpack_from('<i', content)[0]
+        if shape_type == NULL:
+            return None
+
+        if shape_type in point_types:
+            part_count = 0
+            point_count = 1
+            position = 4
+        elif shape_type in multipoint_types:
+            part_count = 0
+            point_count = struct.unpack_from('<i', content, 36)[0]
+            position = 40
+        elif shape_type in part_types:
+            part_count, point_count = struct.unpack_from('<2i', content, 36)
+            position = 44
+        else:
+            raise ShapefileError('Unsupported shape type %d in %s.shp' % (shape_type, self.path))
+
+        if part_count:
+            parts = numpy.frombuffer(content, dtype=offset_dtype, count=part_count, offset=position)
+            position += 4 * part_count
+            if shape_type == 31:
+                # Skip the part types of a MultiPatch.
+                position += 4 * part_count
+        else:
+            parts = numpy.zeros(1, dtype=offset_dtype)
+
+        end = position + 16 * point_count
+        if end > len(content):
+            raise ShapefileError('Truncated record %d in %s.shp' % (index, self.path))
+        points = numpy.frombuffer(content, dtype=coordinate_dtype, count=2 * point_count, offset=position).reshape(-1, 2)
+        position = end
+
+        z = None
+        if shape_type in z_types:
+            if shape_type in point_types:
+                z = numpy.frombuffer(content, dtype=coordinate_dtype, count=1, offset=position)
+                position += 8
+            else:
+                z = numpy.frombuffer(content, dtype=coordinate_dtype, count=point_count, offset=position + 16)
+                position += 16 + 8 * point_count
+
+        # M values are optional, so a record may end before them.
+        m = None
+        if shape_type in m_types:
+            if shape_type in point_types:
+                if position + 8 <= len(content):
+                    m = numpy.frombuffer(content, dtype=coordinate_dtype, count=1, offset=position)
+            elif position + 16 + 8 * point_count <= len(content):
+                m = numpy.frombuffer(content, dtype=coordinate_dtype, count=point_count, offset=position + 16)
+
+        return Geometry(shape_type, points, parts, z, m)
+
+    def raw(self, index):
+        """
+        Returns a memoryview of a record in the .dbf file, including its
+        deletion flag.
+        """
+        if self.dbf is None:
+            raise ShapefileError('No .dbf file for %s' % self.path)
+        offset = self.dbf_header.header_length + index * self.record_length
+        return memoryview(self.dbf)[offset:offset + self.record_length]
+
+    def value(self, index, name, default=None):
+        """
+        Returns a record's value for a field, decoded with the shapefile's
+        encoding.
+        """
+        key = name.lower()
+        if key not in self.slices:
+            return default
+        start, end, field = self.slices[key]
+        return decode_value(self.raw(index)[start:end], field, self.encoding)
+
+    def close(self):
+        for data in self.maps:
+            if isinstance(data, mmap.mmap):
+                try:
+                    data.close()
+                except BufferError:
+                    # Arrays still refer to the map, which is closed once they're garbage collected.
+                    pass
+        self.maps = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,149 @@
+# coding: utf-8
+import json
+import os
+import os.path
+import re
+import shutil
+import tempfile
+import unittest
+from datetime import date
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import parse_qs, urlsplit
+from zipfile import ZipFile
+
+import requests
+
+from arcgis import ArcGISError, download_layer, layer_info, pages
+from shapes import Shapefile
+from test_urlcheck import ThreadingHTTPServer, start
+
+
+class LayerHandler(BaseHTTPRequestHandler):
+    """
+    Responds like an ArcGIS REST API map service layer with the server's
+    features, returning object IDs only if the server's `ids` is set.
+    """
+
+    def do_GET(self):
+        server = self.server
+        parts = urlsplit(self.path)
+        params = {key: values[0] for key, values in parse_qs(parts.query).items()}
+        with server.lock:
+            server.requests.append(params)
+
+        if parts.path.endswith('/MapServer/1'):
+            data = {
+                'name': 'Wards',
+                'maxRecordCount': 2,
+                'advancedQueryCapabilities': {'supportsPagination': server.pagination},
+                'editingInfo': {'lastEditDate': 1500000000000},
+                'fields': [
+                    {'name': 'OBJECTID', 'type': 'esriFieldTypeOID'},
+                    {'name': 'NAME', 'type': 'esriFieldTypeString', 'length': 20},
+                    {'name': 'AREA', 'type': 'esriFieldTypeDouble'},
+                    {'name': 'UPDATED', 'type': 'esriFieldTypeDate'},
+                    {'name': 'SHAPE', 'type': 'esriFieldTypeGeometry'},
+                ],
+            }
+        elif parts.path.endswith('/MapServer/1/query'):
+            features = server.features
+            if params.get('returnIdsOnly'):
+                data = {'objectIdFieldName': 'OBJECTID', 'objectIds': [feature['attributes']['OBJECTID'] for feature in features] if server.ids else None}
+            elif params.get('returnCountOnly'):
+                data = {'count': len(features)}
+            else:
+                match = re.match(r'\AOBJECTID >= (\d+) AND OBJECTID <= (\d+)\Z', params['where'])
+                if match:
+                    first, last = int(match.group(1)), int(match.group(2))
+                    features = [feature for feature in features if first <= feature['attributes']['OBJECTID'] <= last]
+                elif server.pagination:
+                    offset = int(params['resultOffset'])
+                    features = features[offset:offset + int(params['resultRecordCount'])]
+                data = {'features': features}
+        else:
+            self.send_error(404)
+            return
+
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ArcGISTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.http = start(ThreadingHTTPServer(('127.0.0.1', 0), LayerHandler))
+        self.http.requests = []
+        self.http.ids = True
+        self.http.pagination = True
+        self.http.features = [{
+            'attributes': {'OBJECTID': i, 'NAME': 'Ward %d' % i, 'AREA': i * 1.5, 'UPDATED': 1500000000000 + i},
+            'geometry': {'rings': [[[i, 0], [i, 1], [i + 1, 1], [i, 0]]]},
+        } for i in (2, 3, 5, 7, 11)]
+        self.url = 'http://127.0.0.1:%d/arcgis/rest/services/Wards/MapServer/1' % self.http.server_address[1]
+        self.session = requests.Session()
+
+    def tearDown(self):
+        self.session.close()
+        self.http.shutdown()
+        self.http.server_close()
+        shutil.rmtree(self.directory)
+
+    def pages(self):
+        return pages(self.session, self.url, layer_info(self.session, self.url))
+
+    def test_object_id_pages(self):
+        self.assertEqual(self.pages(), [
+            {'where': 'OBJECTID >= 2 AND OBJECTID <= 3'},
+            {'where': 'OBJECTID >= 5 AND OBJECTID <= 7'},
+            {'where': 'OBJECTID >= 11 AND OBJECTID <= 11'},
+        ])
+
+    def test_offset_pages(self):
+        self.http.ids = False
+        self.assertEqual([(page['resultOffset'], page['resultRecordCount'], page['orderByFields']) for page in self.pages()], [
+            (0, 2, 'OBJECTID'),
+            (2, 2, 'OBJECTID'),
+            (4, 2, 'OBJECTID'),
+        ])
+
+    def test_no_pagination(self):
+        self.http.ids = False
+        self.http.pagination = False
+        with self.assertRaises(ArcGISError):
+            self.pages()
+
+        # A single page needs no pagination.
+        self.http.features = self.http.features[:2]
+        self.assertEqual(len(self.pages()), 1)
+
+    def test_download_layer(self):
+        for ids in (True, False):
+            self.http.ids = ids
+            path = os.path.join(self.directory, 'wards.zip')
+            download, count = download_layer(self.session, self.url, path, 'wards', layer_info(self.session, self.url))
+            self.assertEqual(count, 5)
+            self.assertEqual(download.path, path)
+
+            with ZipFile(path) as zip_file:
+                self.assertEqual(zip_file.namelist(), ['wards.dbf', 'wards.prj', 'wards.shp', 'wards.shx'])
+                self.assertEqual({member.date_time for member in zip_file.infolist()}, {(2017, 7, 14, 2, 40, 0)})
+                zip_file.extractall(self.directory)
+
+            with Shapefile(os.path.join(self.directory, 'wards')) as shapefile:
+                self.assertEqual([(field.name, field.type) for field in shapefile.fields], [('OBJECTID', 'N'), ('NAME', 'C'), ('AREA', 'N'), ('UPDATED', 'D')])
+                self.assertEqual([record.get('OBJECTID') for record in shapefile], [2, 3, 5, 7, 11])
+                self.assertEqual([record.get('NAME') for record in shapefile], ['Ward 2', 'Ward 3', 'Ward 5', 'Ward 7', 'Ward 11'])
+                self.assertEqual([record.get('AREA') for record in shapefile], [3, 4.5, 7.5, 10.5, 16.5])
+                self.assertEqual({record.get('UPDATED') for record in shapefile}, {date(2017, 7, 14)})
+                self.assertEqual(shapefile[2].geometry.points.tolist(), [[5, 0], [5, 1], [6, 1], [5, 0]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+# coding: utf-8
+import csv
+import os
+import os.path
+import shutil
+import tempfile
+import unittest
+from collections import defaultdict
+from unittest import mock
+
+import cache
+import divisions
+from divisions import division_index
+
+csv_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'country-ca.csv')
+
+
+class DivisionIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        patcher = mock.patch.object(cache, 'cache_directory', self.directory)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(divisions, 'indexes', {})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        with open(csv_path, encoding='utf-8') as f:
+            self.rows = list(csv.DictReader(f))
+        self.index = division_index(csv_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_parent_id(self):
+        division = self.index.get('ocd-division/country:ca/csd:3501005')
+        self.assertEqual(division.parent.id, 'ocd-division/country:ca/cd:3501')
+        division = self.index.get('ocd-division/country:ca/csd:2466023')
+        self.assertEqual(division.parent.id, 'ocd-division/country:ca')
+
+    def test_parents_and_children(self):
+        ids = {row['id'] for row in self.rows}
+        expected = {}
+        children = defaultdict(set)
+        for row in self.rows:
+            parent = row['parent_id'] or row['id'].rsplit('/', 1)[0]
+            if parent in ids:
+                expected[row['id']] = parent
+                children[parent].add(row['id'])
+            else:
+                expected[row['id']] = None
+
+        self.assertEqual(len(self.index), len(self.rows))
+        for row in self.rows:
+            division = self.index.get(row['id'])
+            parent = division.parent
+            self.assertEqual(parent and parent.id, expected[row['id']], row['id'])
+            self.assertEqual({child.id for child in division.children()}, children[row['id']], row['id'])
+
+
+if __name__ == '__main__':
+    unittest.main()
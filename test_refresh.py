@@ -0,0 +1,128 @@
+# coding: utf-8
+import os
+import os.path
+import shutil
+import tempfile
+import time
+import unittest
+from datetime import date
+from http.server import BaseHTTPRequestHandler
+from unittest import mock
+
+import cache
+import refresh
+from downloads import load_state, load_target
+from refresh import Update, download_updates, process_all
+from test_urlcheck import ThreadingHTTPServer, start
+
+
+class ArchiveHandler(BaseHTTPRequestHandler):
+    """
+    Serves the same archive at every path, after a delay.
+    """
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append(self.path)
+            server.active += 1
+            server.peak = max(server.peak, server.active)
+        time.sleep(server.delay)
+        with server.lock:
+            server.active -= 1
+        body = server.body
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/zip')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Last-Modified', 'Mon, 01 Jan 2018 00:00:00 GMT')
+        self.send_header('ETag', '"archive"')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def exclusive_process(slug, config, url, data_file_path, last_updated):
+    """
+    Fails if another update of the same directory is being processed.
+    """
+    busy = os.path.join(os.path.dirname(config['file']), 'busy')
+    fd = os.open(busy, os.O_CREAT | os.O_EXCL)
+    time.sleep(0.1)
+    os.close(fd)
+    os.unlink(busy)
+    return False
+
+
+class SharedURLTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        patcher = mock.patch.object(cache, 'cache_directory', os.path.join(self.directory, '.cache'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.http = start(ThreadingHTTPServer(('127.0.0.1', 0), ArchiveHandler))
+        self.http.requests = []
+        self.http.active = 0
+        self.http.peak = 0
+        self.http.delay = 0
+        self.http.body = b'PK\x05\x06' + b'\0' * 18
+        self.url = 'http://127.0.0.1:%d/wards.zip' % self.http.server_address[1]
+
+        self.sets = []
+        for slug in ('Brampton wards', 'Caledon wards'):
+            path = os.path.join(self.directory, slug)
+            os.makedirs(path)
+            self.sets.append((slug, {'file': os.path.join(path, 'definition.py'), 'last_updated': date(2017, 1, 1), 'data_url': self.url}))
+
+    def tearDown(self):
+        self.http.shutdown()
+        self.http.server_close()
+        shutil.rmtree(self.directory)
+
+    def refresh(self, sets):
+        updates = download_updates(sets, jobs=2, per_host=2)
+        # Processing is tested separately.
+        with mock.patch.object(refresh, 'process', return_value=True):
+            process_all(updates, jobs=1)
+        return [update.slug for update in updates]
+
+    def test_processed_per_directory(self):
+        # Process only the first boundary set, like with a --division selector.
+        self.assertEqual(self.refresh(self.sets[:1]), ['Brampton wards'])
+        # The second boundary set's directory was never processed from the URL.
+        self.assertEqual(self.refresh(self.sets), ['Caledon wards'])
+        self.assertEqual(self.refresh(self.sets), [])
+
+        for slug, config in self.sets:
+            state = load_target(self.url, os.path.dirname(config['file']))
+            self.assertIn('processed', state)
+            self.assertEqual(state['unchanged'], 'Mon, 01 Jan 2018 00:00:00 GMT')
+        # Only the transfer is stored by URL.
+        self.assertNotIn('processed', load_state(self.url))
+        self.assertEqual(load_state(self.url)['etag'], '"archive"')
+
+    def test_changed_archive(self):
+        self.assertEqual(self.refresh(self.sets), ['Brampton wards', 'Caledon wards'])
+        self.http.body += b'\0'
+        self.assertEqual(self.refresh(self.sets), ['Brampton wards', 'Caledon wards'])
+
+    def test_one_download_per_url(self):
+        self.http.delay = 0.2
+        # The boundary sets are in different lanes.
+        download_updates(self.sets, jobs=2, per_host=2)
+        self.assertEqual(len(self.http.requests), 2)
+        self.assertEqual(self.http.peak, 1)
+
+    def test_process_one_job_per_directory(self):
+        updates = []
+        for slug, config in self.sets:
+            for i in range(2):
+                updates.append(Update('%s %d' % (slug, i), config, self.url, date(2018, 1, 1), None, None))
+        with mock.patch.object(refresh, 'process', side_effect=exclusive_process):
+            process_all(updates, jobs=4)
+
+
+if __name__ == '__main__':
+    unittest.main()
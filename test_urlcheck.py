@@ -0,0 +1,198 @@
+# coding: utf-8
+import socket
+import socketserver
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from unittest import mock
+
+import urlcheck
+from urlcheck import check_urls
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class ThreadingTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class HTTPHandler(BaseHTTPRequestHandler):
+    """
+    Responds to HEAD requests to /status/<code> with that status code, to GET
+    requests with 200, and to requests to /slow/ and /hang/ after a delay.
+    """
+
+    def respond(self, status, location=None):
+        server = self.server
+        with server.lock:
+            server.active += 1
+            server.peak = max(server.peak, server.active)
+            server.requests.append((self.command, self.path))
+        try:
+            if self.path.startswith('/slow/'):
+                time.sleep(0.2)
+            elif self.path.startswith('/hang/'):
+                time.sleep(1)
+        finally:
+            with server.lock:
+                server.active -= 1
+        self.send_response(status)
+        if location:
+            self.send_header('Location', location)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_HEAD(self):
+        if self.path.startswith('/status/'):
+            self.respond(int(self.path.rsplit('/', 1)[1]))
+        elif self.path == '/moved-to-404':
+            self.respond(302, '/errors/404.html')
+        elif self.path == '/moved':
+            self.respond(302, '/elsewhere')
+        else:
+            self.respond(200)
+
+    def do_GET(self):
+        self.respond(200)
+
+    def log_message(self, *args):
+        pass
+
+
+class FTPHandler(socketserver.StreamRequestHandler):
+    """
+    Supports the commands with which `urlcheck` lists directories.
+    """
+
+    def reply(self, line):
+        self.wfile.write(('%s\r\n' % line).encode('ascii'))
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.connections += 1
+        if server.delay:
+            time.sleep(server.delay)
+        self.reply('220 Ready')
+        directory = '/'
+        passive = None
+        while True:
+            line = self.rfile.readline().decode('ascii').strip()
+            if not line:
+                break
+            command, _, argument = line.partition(' ')
+            command = command.upper()
+            if command == 'USER':
+                self.reply('331 Password required')
+            elif command == 'PASS':
+                self.reply('230 Logged in')
+            elif command == 'TYPE':
+                self.reply('200 Type set')
+            elif command == 'CWD':
+                if argument in server.files:
+                    directory = argument
+                    self.reply('250 OK')
+                else:
+                    self.reply('550 No such directory')
+            elif command == 'PASV':
+                passive = socket.socket()
+                passive.bind(('127.0.0.1', 0))
+                passive.listen(1)
+                port = passive.getsockname()[1]
+                self.reply('227 Entering Passive Mode (127,0,0,1,%d,%d)' % (port >> 8, port & 0xFF))
+            elif command == 'NLST':
+                self.reply('150 Listing')
+                connection, _ = passive.accept()
+                connection.sendall(''.join('%s\r\n' % name for name in server.files[directory]).encode('ascii'))
+                connection.close()
+                passive.close()
+                self.reply('226 Done')
+            elif command == 'QUIT':
+                self.reply('221 Bye')
+                break
+            else:
+                self.reply('502 Not implemented')
+
+
+def start(server):
+    server.lock = threading.Lock()
+    thread = threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05})
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+class URLCheckTestCase(unittest.TestCase):
+    def setUp(self):
+        self.http = start(ThreadingHTTPServer(('127.0.0.1', 0), HTTPHandler))
+        self.http.active = 0
+        self.http.peak = 0
+        self.http.requests = []
+        self.base = 'http://127.0.0.1:%d' % self.http.server_address[1]
+
+        self.ftp = start(ThreadingTCPServer(('127.0.0.1', 0), FTPHandler))
+        self.ftp.connections = 0
+        self.ftp.delay = 0
+        self.ftp.files = {'/pub': ['a.zip', 'b.zip'], '/other': ['c.zip']}
+        self.ftp_base = 'ftp://127.0.0.1:%d' % self.ftp.server_address[1]
+
+    def tearDown(self):
+        for server in (self.http, self.ftp):
+            server.shutdown()
+            server.server_close()
+
+    def test_head_fallback(self):
+        urls = ['%s/status/%d' % (self.base, status) for status in (204, 403, 405, 500)]
+        for result in check_urls(urls):
+            self.assertEqual(result.status, 200)
+            self.assertEqual(result.method, 'GET')
+
+    def test_head(self):
+        result = check_urls(['%s/status/404' % self.base])[0]
+        self.assertEqual(result.status, 404)
+        self.assertEqual(result.method, 'HEAD')
+
+    def test_redirect_to_404(self):
+        result = check_urls(['%s/moved-to-404' % self.base])[0]
+        self.assertEqual(result.status, 200)
+        self.assertEqual(result.method, 'GET')
+        self.assertIn(('GET', '/moved-to-404'), self.http.requests)
+
+    def test_redirect(self):
+        result = check_urls(['%s/moved' % self.base])[0]
+        self.assertEqual(result.status, 302)
+        self.assertEqual(result.method, 'HEAD')
+        self.assertEqual(result.location, '/elsewhere')
+
+    def test_per_host(self):
+        urls = ['%s/slow/%d' % (self.base, i) for i in range(6)]
+        for per_host in (1, 2):
+            self.http.peak = 0
+            results = check_urls(urls, jobs=8, per_host=per_host)
+            self.assertEqual([result.url for result in results], urls)
+            self.assertEqual(self.http.peak, per_host)
+
+    def test_timeout(self):
+        with mock.patch.object(urlcheck, 'timeout', (1, 0.2)):
+            result = check_urls(['%s/hang/1' % self.base])[0]
+        self.assertEqual(result.status, 'Timeout')
+
+    def test_ftp(self):
+        urls = ['%s%s' % (self.ftp_base, path) for path in ('/pub/a.zip', '/pub/b.zip', '/pub/d.zip', '/missing/e.zip', '/other/c.zip')]
+        results = check_urls(urls)
+        self.assertEqual([result.status for result in results], [200, 200, 404, '550 No such directory', 200])
+        self.assertEqual(self.ftp.connections, 1)
+
+    def test_ftp_timeout(self):
+        self.ftp.delay = 1
+        with mock.patch.object(urlcheck, 'timeout', (0.2, 0.2)):
+            result = check_urls(['%s/pub/a.zip' % self.ftp_base])[0]
+        self.assertEqual(result.status, 'Timeout')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,180 @@
+# coding: utf-8
+import ftplib
+import os.path
+import socket
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import requests
+
+from cache import dump, load
+from remote import timeout
+
+"""
+The result of checking a URL. `status` is the HTTP status code, or a string
+describing the error. `method` is the method whose response was used, and
+`location` is the redirect target, if any.
+"""
+URLStatus = namedtuple('URLStatus', ['url', 'status', 'method', 'location', 'etag'])
+
+headers = {'User-Agent': 'Mozilla/5.0 (compatible; MSIE 10.0; Windows NT 6.1; Trident/6.0)'}
+
+
+def check_http(session, url):
+    """
+    Returns the status of an HTTP URL.
+    """
+    parsed = urlparse(url)
+    target = url
+    arguments = {'headers': headers, 'timeout': timeout}
+    if parsed.username:
+        target = '%s://%s%s' % (parsed.scheme, parsed.hostname, parsed.path)
+        arguments['auth'] = (parsed.username, parsed.password)
+
+    try:
+        method = 'HEAD'
+        try:
+            response = session.head(target, **arguments)
+        except requests.exceptions.SSLError:
+            arguments['verify'] = False
+            response = session.head(target, **arguments)
+        # If HEAD requests are not properly supported.
+        if response.status_code in (204, 403, 405, 500) or (response.status_code == 302 and '404' in response.headers.get('Location', '')):
+            method = 'GET'
+            response = session.get(target, stream=True, **arguments)
+            # Release the connection without reading the body.
+            response.close()
+    except requests.exceptions.Timeout:
+        return URLStatus(url, 'Timeout', None, None, None)
+    except requests.exceptions.ConnectionError:
+        return URLStatus(url, 404, None, None, None)
+    except requests.exceptions.RequestException as e:
+        return URLStatus(url, str(e), None, None, None)
+
+    if response.is_redirect:
+        location = response.headers.get('Location')
+    elif response.url != target:
+        location = response.url
+    else:
+        location = None
+    return URLStatus(url, response.status_code, method, location, response.headers.get('ETag'))
+
+
+def check_ftp(ftp, listings, url):
+    """
+    Returns an FTP connection to the URL's host, or None if the connection
+    failed, and the status of the URL. `listings` caches the connection's
+    directory listings.
+    """
+    parsed = urlparse(url)
+    directory, name = os.path.split(parsed.path)
+    connection = ftp
+    try:
+        if connection is None:
+            connection = ftplib.FTP()
+            connection.connect(parsed.hostname, parsed.port or 21, timeout=timeout[0])
+            connection.sock.settimeout(timeout[1])
+            connection.login(parsed.username, parsed.password)
+            listings.clear()
+        if directory not in listings:
+            connection.cwd(directory)
+            listings[directory] = set(connection.nlst())
+    except socket.timeout:
+        connection.close()
+        return None, URLStatus(url, 'Timeout', None, None, None)
+    except ftplib.error_perm as e:
+        # A missing directory doesn't require a new connection.
+        if ftp is None:
+            connection.close()
+            connection = None
+        return connection, URLStatus(url, str(e), None, None, None)
+    except ftplib.all_errors as e:
+        connection.close()
+        return None, URLStatus(url, str(e), None, None, None)
+
+    if name in listings[directory]:
+        return connection, URLStatus(url, 200, 'NLST', None, None)
+    return connection, URLStatus(url, 404, 'NLST', None, None)
+
+
+def check_lane(urls):
+    """
+    Checks URLs to the same host one at a time, reusing one connection.
+    """
+    results = []
+    session = requests.Session()
+    ftp = None
+    listings = {}
+    try:
+        for url in urls:
+            if urlparse(url).scheme == 'ftp':
+                ftp, result = check_ftp(ftp, listings, url)
+            else:
+                result = check_http(session, url)
+            results.append(result)
+    finally:
+        session.close()
+        if ftp:
+            try:
+                ftp.quit()
+            except ftplib.all_errors:
+                ftp.close()
+    return results
+
+
+def host_lanes(items, url=lambda item: item, per_host=2):
+    """
+    Splits items into lanes, each of which is to be processed by one thread, one
+    item at a time, so that at most `per_host` connections are made to each HTTP
+    host and one connection to each FTP host. `url` returns an item's URL.
+    """
+    hosts = OrderedDict()
+    for item in items:
+        parsed = urlparse(url(item))
+        if parsed.scheme == 'ftp':
+            key = ('ftp', parsed.hostname, parsed.port, parsed.username)
+        else:
+            key = ('http', parsed.hostname)
+        hosts.setdefault(key, []).append(item)
+
+    lanes = []
+    for key, host_items in hosts.items():
+        count = 1 if key[0] == 'ftp' else max(per_host, 1)
+        lanes.extend(host_items[i::count] for i in range(min(count, len(host_items))))
+    # Start the longest lanes first.
+    lanes.sort(key=len, reverse=True)
+    return lanes
+
+
+def check_urls(urls, jobs=8, per_host=2):
+    """
+    Checks URLs concurrently, with at most `jobs` connections in total and at
+    most `per_host` connections to each HTTP host, and returns their statuses in
+    order. One FTP connection is used for each FTP host.
+    """
+    statuses = {}
+    with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+        for results in executor.map(check_lane, host_lanes(urls, per_host=per_host)):
+            for result in results:
+                statuses[result.url] = result
+    return [statuses[url] for url in urls]
+
+
+def recheck_urls(urls, state_path, max_age=0, jobs=8, per_host=2):
+    """
+    Checks URLs that weren't checked in the last `max_age` seconds, and returns
+    each URL's previous and current statuses, in order. The statuses and the
+    times at which they were checked are stored in `state_path`.
+    """
+    state = load(state_path, {})
+    now = time.time()
+
+    stale = [url for url in urls if url not in state or now - state[url][1] >= max_age]
+    current = dict(state)
+    for result in check_urls(stale, jobs=jobs, per_host=per_host):
+        current[result.url] = (result, now)
+    dump(state_path, current)
+
+    return [(state[url][0] if url in state else None, current[url][0]) for url in urls]
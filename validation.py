@@ -0,0 +1,303 @@
+# coding: utf-8
+import json
+import os
+import os.path
+import re
+from collections import namedtuple
+from multiprocessing import Pool
+from xml.etree import ElementTree
+
+from constants import all_rights_reserved_licenses, terms, terms_re, valid_keys
+from cache import cache_key, cached_digest, dump, load
+from divisions import division_index
+from expectations import divisions_with_boroughs, get_definition, get_definition_memo, memoize_definitions, ocd_division_csv
+from licensing import LicenseIndex
+from loader import dirname, field_value, freeze
+
+"""
+A problem with a boundary set's definition. `severity` is "error" or "warning".
+Warnings are reported once per message.
+"""
+Finding = namedtuple('Finding', ['slug', 'rule', 'expected', 'actual', 'severity', 'message'])
+
+"""
+The state shared by all validations in a process.
+"""
+context = {}
+
+
+def has_multiple_sets(division_id):
+    ocd_type = division_id.rsplit('/', 1)[1].split(':')[0]
+    return ocd_type in ('country', 'province', 'territory') or division_id in (
+        'ocd-division/country:ca/csd:3520005',  # Toronto
+    )
+
+
+def describe(expected):
+    """
+    Returns a JSON-serializable description of an expected value.
+    """
+    if isinstance(expected, re._pattern_type):
+        return expected.pattern
+    return expected
+
+
+def validate(slug, config, license):
+    """
+    Returns the problems with a boundary set's definition. `license` is what its
+    LICENSE.txt matches, if any.
+    """
+    findings = []
+
+    def error(rule, message, expected=None, actual=None):
+        findings.append(Finding(slug, rule, describe(expected), actual, 'error', message))
+
+    def assert_match(field, actual, expected):
+        if isinstance(expected, re._pattern_type):
+            if not expected.search(actual):
+                error('expected-%s' % field, 'Expected %s to match %s not %s' % (field, expected.pattern, actual), expected, actual)
+        elif isinstance(expected, list):
+            if actual not in expected:
+                error('expected-%s' % field, 'Expected %s to be %s not %s' % (field, expected[-1], actual), expected, actual)
+        elif actual != expected and expected is not None:
+            error('expected-%s' % field, 'Expected %s to be %s not %s' % (field, expected, actual), expected, actual)
+
+    if config.get('extra'):
+        division_id = config['extra']['division_id']
+    else:
+        division_id = None
+
+    # Validate LICENSE.txt.
+    if license is not None:
+        if 'licence_url' in config:
+            licence_url = config['licence_url']
+            if licence_url in context['licenses_with_templates']:
+                if licence_url not in terms and not terms_re.get(licence_url):
+                    message = 'No LICENSE.txt template for License URL %s' % licence_url
+                    findings.append(Finding(slug, 'license-template-missing', None, licence_url, 'warning', message))
+                elif licence_url in terms and licence_url not in license.exact or terms_re.get(licence_url) and licence_url not in license.patterns:
+                    error('license-template', 'Expected LICENSE.txt to match license-specific template', licence_url, sorted(license.exact | license.patterns))
+            elif licence_url in all_rights_reserved_licenses:
+                if not license.all_rights_reserved:
+                    error('license-all-rights-reserved', 'Expected LICENSE.txt to match "all rights reserved" template')
+            else:
+                error('licence-url-unrecognized', 'Unrecognized License URL %s' % licence_url, actual=licence_url)
+        elif not license.all_rights_reserved:
+            error('license-all-rights-reserved', 'Expected LICENSE.txt to match "all rights reserved" template')
+
+    # Check for invalid keys, non-unique or empty values.
+    invalid_keys = set(config.keys()) - valid_keys
+    if invalid_keys:
+        error('key-unrecognized', 'Unrecognized key: %s' % ', '.join(invalid_keys), actual=sorted(invalid_keys))
+    values = [value for key, value in config.items() if key != 'extra']
+    if len(values) > len(set(values)):
+        error('values-non-unique', 'Non-unique values')
+    for key, value in config.items():
+        if not value:
+            error('value-empty', 'Empty value for %s' % key, actual=key)
+
+    # Check for missing required keys.
+    for key in ('domain', 'last_updated', 'name_func', 'authority', 'encoding'):
+        if key not in config:
+            error('key-missing', 'Missing %s' % key, expected=key)
+    if 'source_url' not in config and 'data_url' in config:
+        error('key-missing', 'Missing source_url', expected='source_url')
+    if 'source_url' in config and 'licence_url' not in config and 'data_url' not in config:
+        error('key-missing', 'Missing licence_url or data_url', expected=['licence_url', 'data_url'])
+
+    # Validate fields.
+    if 'name' in config:
+        error('key-unexpected', 'Expected name to be missing', actual='name')
+    if 'singular' in config and not slug.endswith(')') and not has_multiple_sets(division_id):
+        error('key-unexpected', 'Expected singular to be missing', actual='singular')
+
+    if slug not in ('Census divisions', 'Census subdivisions'):
+        # Check for invalid keys or empty values.
+        invalid_keys = set(config['extra'].keys()) - {'division_id'}
+        if invalid_keys:
+            error('key-unrecognized', 'Unrecognized key: %s' % ', '.join(invalid_keys), actual=sorted(invalid_keys))
+        for key, value in config['extra'].items():
+            if not value:
+                error('value-empty', 'Empty value for %s' % key, actual=key)
+
+        # Ensure division_id is unique.
+        if context['first_slugs'][division_id] != slug and division_id not in divisions_with_boroughs() and not has_multiple_sets(division_id):
+            error('division-id-duplicate', 'Duplicate division_id %s' % division_id, actual=division_id)
+
+        if not division_index(ocd_division_csv).get(division_id).name:
+            message = 'Unknown name for %s: check slug and domain manually' % division_id
+            findings.append(Finding(slug, 'division-name-unknown', None, division_id, 'warning', message))
+
+        expected_slug, expected_config = get_definition(division_id, path=config['file'], quiet=True)
+
+        # Check for unexpected values.
+        if not slug.endswith(')'):
+            assert_match('slug', slug, expected_slug)
+        for key, value in expected_config.items():
+            assert_match(key, config[key], value)
+
+    return findings
+
+
+def validate_directory(job):
+    """
+    Returns the problems with the boundary sets in a directory, and the expected
+    definitions that were determined.
+    """
+    directory, entries, license = job
+
+    results = []
+    for slug, config in entries:
+        results.append((slug, validate(slug, config, license)))
+
+    keys = ((config['extra']['division_id'], config['file']) for slug, config in entries if config.get('extra'))
+    return results, {key: get_definition_memo[key] for key in keys if key in get_definition_memo}
+
+
+def initialize(licenses_with_templates, first_slugs):
+    """
+    Sets the state shared by all validations in a process.
+    """
+    context['licenses_with_templates'] = licenses_with_templates
+    context['first_slugs'] = first_slugs
+
+
+def directory_inputs(directory, slugs, index, first_slugs, digests):
+    """
+    Returns the inputs to the validation of the boundary sets in a directory:
+    the hashes of its files, the slugs, and the expectations for their divisions.
+    """
+    inputs = [directory, slugs]
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if os.path.isfile(path) and name != '.DS_Store':
+            inputs.append((name, cached_digest(path, digests)))
+    for slug in slugs:
+        division_id = field_value(index[slug], 'division_id')
+        if division_id:
+            inputs.append((
+                division_id,
+                first_slugs[division_id],
+                division_id in divisions_with_boroughs(),
+                division_index(ocd_division_csv).get(division_id).name,
+                get_definition(division_id, path=index[slug]['file'], quiet=True),
+            ))
+    return inputs
+
+
+def run_validation(index, licenses_with_templates, jobs=1, state_path=None):
+    """
+    Validates the boundary sets in a `RegistryIndex`, one directory per job, and
+    yields each slug and its problems, in registry order. If `jobs` is 0, uses
+    one process per CPU.
+
+    If `state_path` is set, the results are stored in that file, and directories
+    are re-validated only if their files, the expectations for their divisions,
+    the license templates or the validation rules changed.
+    """
+    first_slugs = {division_id: slugs[0] for division_id, slugs in index.groups('division_id')}
+
+    findings = {}
+    groups = []
+    keys = {}
+    if state_path:
+        state = load(state_path, {})
+        digests = state.get('digests', {})
+        directories = state.get('directories', {})
+
+        directory = os.path.dirname(os.path.abspath(__file__))
+        common = [sorted(licenses_with_templates)]
+        for name in ('constants.py', 'expectations.py', 'licensing.py', 'validation.py'):
+            common.append(cached_digest(os.path.join(directory, name), digests))
+
+    licenses = LicenseIndex()
+    for directory, slugs in index.groups('directory'):
+        if state_path:
+            keys[directory] = cache_key(common, directory_inputs(directory, slugs, index, first_slugs, digests))
+            if directory in directories and directories[directory][0] == keys[directory]:
+                findings.update(directories[directory][1])
+                continue
+        license_path = os.path.join(directory, 'LICENSE.txt')
+        license = licenses.match_file(license_path) if os.path.exists(license_path) else None
+        # Callables are replaced, so that the configurations can be sent to other processes.
+        groups.append((directory, [freeze(index.paths.get(slug), [(slug, index[slug])])[0] for slug in slugs], license))
+
+    if jobs == 1 or len(groups) < 2:
+        initialize(licenses_with_templates, first_slugs)
+        results = map(validate_directory, groups)
+        pool = None
+    else:
+        pool = Pool(jobs or None, initialize, (licenses_with_templates, first_slugs))
+        results = pool.imap(validate_directory, groups)
+
+    try:
+        for (directory, entries, license), (result, definitions) in zip(groups, results):
+            memoize_definitions(definitions)
+            findings.update(result)
+            if state_path:
+                directories[directory] = (keys[directory], result)
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+
+    if state_path:
+        dump(state_path, {'digests': digests, 'directories': directories})
+
+    seen = set()
+    for slug in index:
+        kept = []
+        for finding in findings[slug]:
+            if finding.severity == 'warning':
+                if finding.message in seen:
+                    continue
+                seen.add(finding.message)
+            kept.append(finding)
+        yield slug, kept
+
+
+def write_text(results, stream):
+    for slug, findings in results:
+        for finding in findings:
+            stream.write('%-60s %s\n' % (finding.slug, finding.message))
+
+
+def write_jsonl(results, stream):
+    for slug, findings in results:
+        for finding in findings:
+            stream.write(json.dumps(finding._asdict(), ensure_ascii=False, default=str) + '\n')
+
+
+def write_junit(results, stream, index):
+    suite = ElementTree.Element('testsuite', name='definitions')
+    tests = failures = 0
+    for slug, findings in results:
+        tests += 1
+        testcase = ElementTree.SubElement(suite, 'testcase', classname=dirname(index[slug]['file']), name=slug)
+        errors = [finding for finding in findings if finding.severity == 'error']
+        warnings = [finding for finding in findings if finding.severity == 'warning']
+        if errors:
+            failures += 1
+            failure = ElementTree.SubElement(testcase, 'failure', message=errors[0].message, type=errors[0].rule)
+            failure.text = '\n'.join('%s: %s' % (finding.rule, finding.message) for finding in errors)
+        if warnings:
+            ElementTree.SubElement(testcase, 'system-out').text = '\n'.join('%s: %s' % (finding.rule, finding.message) for finding in warnings)
+    suite.set('tests', str(tests))
+    suite.set('failures', str(failures))
+    suite.set('errors', '0')
+    stream.write(ElementTree.tostring(suite, encoding='unicode'))
+    stream.write('\n')
+
+
+def write_results(results, stream, output, index):
+    """
+    Writes the problems as text, JSON Lines or JUnit XML.
+    """
+    if output == 'text':
+        write_text(results, stream)
+    elif output == 'jsonl':
+        write_jsonl(results, stream)
+    elif output == 'junit':
+        write_junit(results, stream, index)
+    else:
+        raise ValueError('Unrecognized output %s, expected text, jsonl or junit' % output)